@@ -1,10 +1,15 @@
 """This Module will soon become much simpler.  It's been my scratch pad
 during development and probably contains way too many things in it.  
 """
-import arcpy
+from mapbuilder.lazy import arcpy
 import os
+import copy
+import time
+import pickle
+import collections
+import multiprocessing
 
-from mapbuilder import project, layer, table, config
+from mapbuilder import project, layer, table, config, manifest, scheduler, splitter, export, trace, tiles
 
 __version__ = '0.4.7'
 
@@ -12,34 +17,469 @@ class Controller:
     """ The controller class provides the basic logic for automating ArcGIS projects."""
     def __init__(self):
         self.config = config.Config()
+        self.resume = False
+        self.template_cache = None # Set by the service to reuse open template MXDs.
 
             
-    def run(self):
+    def run(self, resume=False, dry_run=False):
         """ Processes a project based on the configuration object defined during
         instantiation.
+
+        With `resume` True, a run that stopped part way (e.g. license or disk
+        errors) continues after the last completed table load, geocode,
+        spatial join or output instead of starting over.  The stopped run
+        must have recorded a checkpoint (config.CHECKPOINT).
+
+        With `dry_run` True, the configuration is only validated (see plan).
+        """
+        if dry_run:
+            return self.plan()
+        self.resume = resume
+        tracer = None
+        if self.config.TRACE or self.config.TRACE_HOOKS:
+            tracer = trace.Tracer(self.config.TRACE_HOOKS)
+            tracer.start([(project.Project, 'project')])
+        try:
+            with trace.span('initiate project', 'stage'):
+                self._inititeProject()
+
+            graph = self._newScheduler()
+            data_tasks = self._addDataTasks(graph, add_tables=True)
+            self._addMapTasks(graph, data_tasks)
+            graph.run()
+            self.prj.PrintGeocodeCacheStats()
+            self.prj.PrintScratchStats()
+            with trace.span('commit', 'stage'):
+                self.prj.Commit()
+                self.prj.CompleteRun()
+            if tracer is not None:
+                for name, rows in self.prj.DatasetRowCounts().items():
+                    tracer.count('rows', name, rows)
+        finally:
+            if tracer is not None:
+                tracer.stop()
+                self._saveTrace(tracer)
+
+
+    def _saveTrace(self, tracer):
+        """ Saves the trace to config.TRACE_PATH (when TRACE is on) and prints
+        its summary.
         """
-        self._inititeProject()
+        tracer.printSummary()
+        if not self.config.TRACE:
+            return
+        path = self.config.TRACE_PATH
+        if path is None:
+            path = os.path.join(self.prj.workspace_path, self.prj.name + '_trace.json')
+        tracer.save(path, self.config.TRACE_FORMAT)
 
-        self._addTablesToProject() # This step adds any geocoded tables to layers
-        self._runSpatialJoins() # These are also added to layers.
-        self._addLayersToProject() # Needs to run after adding tables and spatial joins
 
-        self._sort_layers()
+    def plan(self):
+        """ Validates the configuration and prints the operations a run would
+        perform and the artifacts it would write.  Nothing is written and
+        ArcPy is not imported.
 
-        # Setup Legend
-        self.prj.LegendStart()
+        Checks every Table, Layer, spatial join, sort and output definition
+        and that the files they use exist.  Returns a list of problems,
+        empty when the configuration is valid.
+        """
+        start = time.time()
+        self._setProjectDetails()
+        prj = self.prj
+        prj.gdb_path = os.path.join(prj.workspace_path, prj.name + '.gdb')
+        problems = list()
+        self._checkPath(problems, 'TEMPLATE_MXD', self.config.TEMPLATE_MXD)
+
+        self.tables, split_prefixes = self._planTables(problems)
+        tables = self._newTables()
+        datasets = [tbl.name for tbl in tables]
+        layer_names = list()
+        styles = list()
+        for tbl in tables:
+            if tbl.geocode:
+                datasets.append(tbl.geocoded_layer_name)
+                if tbl.visible:
+                    layer_names.append(tbl.geocoded_layer_name)
+                styles.append(tbl.geocode_layer_style)
+        if [tbl for tbl in tables if tbl.geocode]:
+            self._checkPath(problems, 'ADDRESS_LOCATOR', self.config.ADDRESS_LOCATOR)
+
+        joins = list()
+        for i, join in enumerate(self.config.SPATIAL_JOINS):
+            try:
+                out_name = join['layer_name'] + '__' + join['table_name']
+                prj.JoinBackend(join)
+            except (KeyError, ValueError) as e:
+                problems.append('SPATIAL_JOINS[%s]:  %s' % (i, e))
+                continue
+            if out_name in datasets:
+                problems.append('SPATIAL_JOINS[%s]:  %s is written by more than one join.' % (i, out_name))
+                continue
+            if not self._plannedName(join['table_name'], datasets, split_prefixes):
+                problems.append('SPATIAL_JOINS[%s]:  table_name "%s" is not a table or geocoded '
+                                'layer of this project.' % (i, join['table_name']))
+            self._checkPath(problems, 'SPATIAL_JOINS[%s] layer_path' % (i), join['layer_path'], datasets)
+            datasets.append(out_name)
+            layer_names.append(out_name)
+            styles.append(join.get('layer_style'))
+            joins.append(join)
+
+        for i, definition in enumerate(self.config.LAYERS):
+            try:
+                lyr = layer.Layer(definition)
+            except KeyError as e:
+                problems.append('LAYERS[%s]:  %s' % (i, e))
+                continue
+            self._checkPath(problems, 'Layer %s path' % (lyr.name), lyr.path, datasets)
+            if lyr.visible:
+                layer_names.append(lyr.name)
+            styles.append(lyr.style)
+
+        for style in styles:
+            if style:
+                self._checkPath(problems, 'Style', os.path.join(prj.style_path, style))
+        for name in set(layer_names):
+            if layer_names.count(name) > 1:
+                problems.append('Layer name "%s" is used by %s layers.' % (name, layer_names.count(name)))
+        for i, sort in enumerate(self.config.SORT):
+            try:
+                names = (sort['move_layer_name'], sort['ref_layer_name'])
+                insert_position = sort['insert_position']
+            except KeyError as e:
+                problems.append('SORT[%s]:  missing key %s' % (i, e))
+                continue
+            for name in names:
+                if not self._plannedName(name, layer_names, split_prefixes):
+                    problems.append('SORT[%s]:  no visible layer named "%s".' % (i, name))
+            if insert_position not in ('AFTER', 'BEFORE'):
+                problems.append('SORT[%s]:  insert_position must be AFTER or BEFORE, not "%s".'
+                                % (i, insert_position))
+
+        outputs = self._planOutputs(problems)
+
+        print('\nPlanned operations:')
+        graph = self._newScheduler()
+        try:
+            data_tasks = self._addDataTasks(graph, add_tables=True, joins=joins)
+            self._addMapTasks(graph, data_tasks)
+            for i, name in enumerate(graph.order()):
+                print('  %3s.  %-3s  %s' % (i + 1, graph.tasks[name].kind, name))
+        except (KeyError, ValueError) as e:
+            print('  Not available until the problems below are fixed (%s).' % (e))
+
+        print('\nExpected artifacts:')
+        print('  %s' % (prj.gdb_path))
+        for name in datasets:
+            print('    %s' % (name))
+        print('  %s' % (prj._getMXDPath()))
+        for output in outputs:
+            print('  %s' % (os.path.join(prj.workspace_path,
+                                         export.output_filename(output, prj.output_prefix))))
+
+        if problems:
+            print('\n%s problem(s) found:' % (len(problems)))
+            for problem in problems:
+                print('  %s' % (problem))
+        else:
+            print('\nNo problems found.')
+        print('Planned in %.0f ms, ArcPy imported: %s' % ((time.time() - start) * 1000, arcpy.loaded))
+        return problems
 
-        self.prj.LegendPosition()
-        self.prj.LegendStyle()
-        self.prj.LegendStop()
 
-        self.prj.StyleLayers()
+    def _planTables(self, problems):
+        """ Returns copies of the valid table definitions, and the name
+        prefixes of split tables and their geocoded layers.  Tables split by a
+        column are planned as one table named <name>_<column>.
+        """
+        tables = list()
+        split_prefixes = list()
+        for i, tbl in enumerate(copy.deepcopy(self.config.TABLES)):
+            try:
+                path = self._tablePath(tbl)
+                table.Table(dict(tbl, path=path))
+            except KeyError as e:
+                problems.append('TABLES[%s] (%s):  %s' % (i, tbl.get('name'), e))
+                continue
+            if not self._checkPath(problems, 'Table %s' % (tbl['name']), path):
+                continue
+            if 'split_by' in tbl:
+                try:
+                    splitter.check_header(path, tbl['split_by'], tbl.get('delimiter', '\t'))
+                except KeyError as e:
+                    problems.append('Table %s:  %s' % (tbl['name'], e))
+                split_prefixes.append(tbl['name'] + '_')
+                if 'geocoded_layer_name' in tbl:
+                    split_prefixes.append(tbl['geocoded_layer_name'] + '_')
+                tbl['name'] = '%s_<%s>' % (tbl['name'], tbl.pop('split_by'))
+            tables.append(tbl)
+        return tables, split_prefixes
+
+    def _plannedName(self, name, names, split_prefixes):
+        """ Returns True when `name` is one of `names`, or may be the name of
+        a split table (or its layers), which is only known once the file is
+        split.
+        """
+        if name in names:
+            return True
+        return len([prefix for prefix in split_prefixes if name.startswith(prefix)]) > 0
+
+
+    def _planOutputs(self, problems):
+        try:
+            output_mode = self.config.OUTPUT_MODE
+        except AttributeError:
+            output_mode = None
+        output_list = list()
+        if output_mode == 'Custom':
+            try:
+                output_list = self.config.OUTPUT_LIST
+            except AttributeError:
+                problems.append('OUTPUT_MODE is "Custom" but OUTPUT_LIST is not set.')
+        elif output_mode is not None:
+            problems.append('OUTPUT_MODE "%s" is not supported, use "Custom" with OUTPUT_LIST.'
+                            % (output_mode))
+
+        outputs = list()
+        filenames = set()
+        for i, output in enumerate(output_list):
+            try:
+                bounds = [float(output[key]) for key in ('xmin', 'ymin', 'xmax', 'ymax')]
+                filename = export.output_filename(output, self.prj.output_prefix)
+            except KeyError as e:
+                problems.append('OUTPUT_LIST[%s]:  missing key %s' % (i, e))
+                continue
+            except (TypeError, ValueError) as e:
+                problems.append('OUTPUT_LIST[%s]:  %s' % (i, e))
+                continue
+            if bounds[0] >= bounds[2] or bounds[1] >= bounds[3]:
+                problems.append('OUTPUT_LIST[%s] (%s):  xmin/ymin must be less than xmax/ymax.'
+                                % (i, output['name']))
+            if filename in filenames:
+                problems.append('OUTPUT_LIST[%s]:  %s is written by more than one output.' % (i, filename))
+            filenames.add(filename)
+            outputs.append(output)
+
+        for i, definition in enumerate(self.config.OUTPUT_TILES):
+            label = 'OUTPUT_TILES[%s] (%s)' % (i, definition.get('name'))
+            if 'path' in definition:
+                if 'name' not in definition:
+                    problems.append('%s:  missing key "name"' % (label))
+                self._checkPath(problems, label, definition['path'])
+                continue
+            try:
+                tiled = tiles.grid_outputs(definition)
+            except (KeyError, TypeError, ValueError) as e:
+                problems.append('%s:  %s' % (label, e))
+                continue
+            print('\n%s:  %s tiles before empty tiles are skipped.' % (label, len(tiled)))
+            for output in tiled:
+                filename = export.output_filename(output, self.prj.output_prefix)
+                if filename in filenames:
+                    problems.append('%s:  %s is written by more than one output.' % (label, filename))
+                filenames.add(filename)
+            outputs.extend(tiled)
+        return outputs
+
+
+    def _checkPath(self, problems, label, path, datasets=None):
+        """ Adds a problem when `path` does not exist.  Paths inside the
+        project GDB count when they are one of `datasets`, paths inside other
+        GDBs only need the GDB to exist.
+        """
+        if path and os.path.exists(path):
+            return True
+        if path and datasets is not None:
+            if os.path.dirname(path) == self.prj.gdb_path and os.path.basename(path) in datasets:
+                return True
+            if manifest.gdb_root(path) is not None:
+                return True
+        problems.append('%s not found:  %s' % (label, path))
+        return False
+
+
+    def runVariant(self, shared):
+        """ Processes the map stages (layers, sort, legend, style, outputs) of
+        a project using data already loaded by a BatchController.
+
+        `shared` is the dictionary returned by runDataStages().
+        """
+        self._configureProject()
+        self.prj.shared_gdb_path = shared['gdb_path']
+        self.prj.generalized = shared['generalized']
+        self.prj.getMXDFile()
+        self.prj.AddSharedData(shared['tables'],
+                               [layer.Layer(definition) for definition in shared['layers']])
+
+        graph = self._newScheduler()
+        self._addMapTasks(graph, list())
+        graph.run()
+        self.prj.Commit()
+        self.prj.CompleteRun()
+
+
+    def runDataStages(self):
+        """ Loads tables, geocodes and runs spatial joins into the project GDB
+        without creating an MXD.
+
+        Returns a dictionary with the GDB path, the loaded table paths and the
+        layer definitions created by geocoding and joins, for runVariant().
+        """
+        self._configureProject()
+        self.prj.data_only = True
+        self.prj.OpenData()
+
+        graph = self._newScheduler()
+        self._addDataTasks(graph, add_tables=False)
+        graph.run()
+        self.prj.PrintGeocodeCacheStats()
+        self.prj.PrintScratchStats()
+        self._collectTaskLayers()
+        self.prj.CompleteRun()
+        return {'gdb_path': self.prj.gdb_path,
+                'tables': [tbl.path for tbl in self.prj._tables],
+                'layers': [vars(lyr) for lyr in self.prj.new_layers],
+                'generalized': self.prj.generalized}
+
+
+    def _newScheduler(self):
+        self._task_layers = collections.OrderedDict()
+        return scheduler.Scheduler(self.config.TASK_WORKERS, project.run_task)
+
+
+    def _addDataTasks(self, graph, add_tables=True, joins=None):
+        """ Adds table load, geocode and spatial join tasks to `graph` and
+        returns their names.  `joins` defaults to SPATIAL_JOINS.
+
+        These tasks only write to the project GDB.  Edges come from the
+        datasets each task reads:  a geocode needs its table, a join needs
+        the tasks producing its table and layer.
+        """
+        prj = self.prj
+        tables = self._newTables()
+        producers = dict() # Dataset path -> name of the task writing it
+        table_tasks = list()
+        data_tasks = list()
+        for tbl in tables:
+            task = graph.add(self._gdbTask('table:' + tbl.name, 'LoadTable', (tbl,)))
+            producers[self._datasetKey(tbl.name)] = task.name
+            table_tasks.append(task.name)
+        data_tasks.extend(table_tasks)
+
+        if add_tables and not prj.mxd_current:
+            table_paths = [tbl.path for tbl in tables]
+            graph.add(scheduler.Task('add tables', lambda: prj.AddTableViews(table_paths),
+                                     table_tasks))
+
+        for tbl in tables:
+            if tbl.geocode:
+                # Sharded geocoding starts its own pool, which pool workers can not do, and
+                # the geocode cache is a SQLite file written by one process at a time.
+                pooled = not (self.config.GEOCODE_CACHE
+                              or (tbl.geocode_shard_size and tbl.geocode_workers > 1))
+                task = graph.add(self._gdbTask('geocode:' + tbl.geocoded_layer_name, 'GeocodeTable',
+                                               (tbl,), ['table:' + tbl.name], pooled))
+                producers[self._datasetKey(tbl.geocoded_layer_name)] = task.name
+                data_tasks.append(task.name)
+
+        if joins is None:
+            joins = self.config.SPATIAL_JOINS
+        for join in joins:
+            out_name = join['layer_name'] + '__' + join['table_name']
+            deps = list()
+            for path in (self._datasetKey(join['table_name']),
+                         os.path.normcase(os.path.normpath(join['layer_path']))):
+                if path in producers:
+                    deps.append(producers[path])
+            task = graph.add(self._gdbTask('join:' + out_name, 'JoinSpatialTableToLayer',
+                                           (join,), deps))
+            producers[self._datasetKey(out_name)] = task.name
+            data_tasks.append(task.name)
+
+        for lyr in self.config.LAYERS:
+            if lyr.get('generalize'):
+                path = os.path.normcase(os.path.normpath(lyr['path']))
+                deps = [producers[path]] if path in producers else list()
+                task = graph.add(self._gdbTask('generalize:' + lyr['name'], 'GeneralizeLayer',
+                                               (lyr,), deps))
+                data_tasks.append(task.name)
+        return data_tasks
+
+
+    def _addMapTasks(self, graph, data_tasks):
+        """ Adds the MXD tasks (layers, sort, legend, style) and outputs to
+        `graph`.  These run one at a time in this process, after every data
+        task since layers are added from the data tasks' results.
+        """
+        prj = self.prj
+        deps = list(data_tasks)
+        if prj.mxd_current:
+            print('\nProject MXD is current.  Skipping layers, sort, legend and style.')
+        else:
+            for name, run in (('layers', self._addLayersToProject), # Needs to run after adding tables and spatial joins
+                              ('sort', self._sort_layers),
+                              ('legend', self._setupLegend),
+                              ('style', prj.StyleLayers),
+                              ('save mxd', prj.CompleteMXD)):
+                graph.add(scheduler.Task(name, run, deps))
+                deps = [name]
+        graph.add(scheduler.Task('outputs', self._save_outputs, deps))
+
+
+    def _gdbTask(self, name, method, args, deps=None, pooled=True):
+        """ Returns a GDB task running a Project method.  In a worker process
+        the method runs on a copy of the project, pickled when the task is
+        dispatched, and the result is merged back here.  Tasks that are not
+        `pooled` always run in this process.
+        """
+        prj = self.prj
+        self._task_layers[name] = list()
+
+        def done(result):
+            self._task_layers[name] = prj.MergeTaskResult(result)
+
+        job = None
+        if pooled:
+            job = lambda: pickle.dumps((prj, method, args), 2)
+        return scheduler.Task(name, lambda: getattr(prj, method)(*args), deps, scheduler.GDB,
+                              job=job, done=done)
+
+
+    def _collectTaskLayers(self):
+        """ Adds the layers created by worker processes, in task order. """
+        for layers in self._task_layers.values():
+            self.prj.new_layers.extend(layers)
+        self._task_layers = collections.OrderedDict()
+
 
-        self._save_outputs()
+    def _datasetKey(self, name):
+        return os.path.normcase(os.path.normpath(os.path.join(self.prj.gdb_path, name)))
 
 
     def _inititeProject(self):
         """ Initiates project based on defined Config class. """
+        self._configureProject()
+
+        # Called to ensure new MXDFile is created, even if layers/tables aren't added.
+        self.prj.getMXDFile()
+
+
+    def _configureProject(self):
+        """ Creates the project and sets its details from the Config class. """
+        self._setProjectDetails()
+        self.tables = self._splitTables()
+        self.prj.mxd_definition = copy.deepcopy({'tables': self.tables,
+                                                 'layers': self.config.LAYERS,
+                                                 'spatial_joins': self.config.SPATIAL_JOINS,
+                                                 'sort': self.config.SORT})
+
+        # I'm not sure this is needed, should try testing at some point in the future...
+        arcpy.env.overwriteOutput = True
+
+
+    def _setProjectDetails(self):
+        """ Creates the project and copies settings from the Config class,
+        without touching ArcPy or the file system.
+        """
         self.prj = project.Project()
 
         # Set Generic Project Details
@@ -51,6 +491,7 @@ class Controller:
 
         # Set MXD Template to use
         self.prj.template_mxd = self.config.TEMPLATE_MXD
+        self.prj.template_cache = self.template_cache
 
         # Set dynamic text elements
         self.prj.header_prefix = self.config.OUTPUT_HEADER_PREFIX
@@ -60,42 +501,94 @@ class Controller:
         self.prj.legend_x = self.config.LEGEND_X
         self.prj.legend_y = self.config.LEGEND_Y
 
-        self.prj.address_locator = self.config.ADDRESS_LOCATOR
+        self.prj.output_workers = self.config.OUTPUT_WORKERS
+        self.prj.save_every_step = self.config.SAVE_EVERY_STEP
+        self.prj.style_batch = self.config.STYLE_BATCH
+        self.prj.spatial_join_backend = self.config.SPATIAL_JOIN_BACKEND
 
-        # I'm not sure this is needed, should try testing at some point in the future...
-        arcpy.env.overwriteOutput = True
-
-        # Called to ensure new MXDFile is created, even if layers/tables aren't added.
-        self.prj.getMXDFile()
+        self.prj.address_locator = self.config.ADDRESS_LOCATOR
+        self.prj.geocode_cache = self.config.GEOCODE_CACHE
+        self.prj.geocode_cache_path = self.config.GEOCODE_CACHE_PATH
+        self.prj.geocode_cache_max_age_days = self.config.GEOCODE_CACHE_MAX_AGE_DAYS
+
+        # Incremental builds reuse the GDB and MXD when definitions are unchanged.
+        self.prj.incremental = self.config.INCREMENTAL
+        self.prj.scratch = self.config.SCRATCH
+        self.prj.scratch_available = self.config.TASK_WORKERS <= 1
+        self.prj.cull_layers = self.config.CULL_LAYERS
+        self.prj.cull_legend = self.config.CULL_LEGEND
+        self.prj.render_cache = self.config.RENDER_CACHE
+        self.prj.render_refresh = self.config.RENDER_REFRESH
+        self.prj.checkpointing = self.config.CHECKPOINT
+        self.prj.resume = self.resume
 
     
-    def _addTablesToProject(self):
-        """ Prepares defined data (attribute) table(s) to project.
-        
-        This method takes data from project's config and creates Table objects using the Table class.
+    def _newTables(self):
+        """ Creates Table objects for the project's table definitions.
 
-        Other than appending the items to the list this handles differences between normal data files
-        (e.g. Tab delimited .txt file) vs Attribute tables already stored in a GDB.
+        This handles differences between normal data files (e.g. Tab
+        delimited .txt file) vs Attribute tables already stored in a GDB.
+        Tables are returned in the order Project.AddTables loads them.
         """
-        prj = self.prj
-        for tbl in self.config.TABLES:
-            # If extension set, it's a data source like ".txt", otherwise it's assumed to be in a DBF.
-            if tbl['extension']:
-                data_name = tbl['name'] + tbl['extension']
-            else:
-                data_name = tbl['name']
-
-            # Uses defined path if provided, otherwise uses project's default data path.
-            if tbl['path']:
-                data_path = os.path.join(tbl['path'], data_name)
-            else:
-                data_path = os.path.join(prj.data_path, data_name)
+        tables = list()
+        for tbl in self.tables:
+            data_path = self._tablePath(tbl)
 
             tbl['path'] = data_path
-            tbl = table.Table(tbl)
-            prj.new_tables.append(tbl)
+            tables.append(table.Table(tbl))
+        tables.reverse()
+        return tables
+
+    def _tablePath(self, tbl):
+        """ Returns the path to a table definition's data. """
+        # If extension set, it's a data source like ".txt", otherwise it's assumed to be in a DBF.
+        if tbl['extension']:
+            data_name = tbl['name'] + tbl['extension']
+        else:
+            data_name = tbl['name']
+
+        # Uses defined path if provided, otherwise uses project's default data path.
+        if tbl['path']:
+            return os.path.join(tbl['path'], data_name)
+        return os.path.join(self.prj.data_path, data_name)
+
+    def _splitTables(self):
+        """ Returns the table definitions with each table that sets "split_by"
+        replaced by one table per value of that column.
 
-        prj.AddTables()
+        Split tables are named <name>_<value> and inherit every other key
+        (geocode, style, visible, ...) from their definition.
+        """
+        tables = list()
+        for tbl in self.config.TABLES:
+            try:
+                split_by = tbl['split_by']
+            except KeyError:
+                tables.append(tbl)
+                continue
+
+            try:
+                delimiter = tbl['delimiter']
+            except KeyError:
+                delimiter = '\t'
+            try:
+                max_open = tbl['split_max_open']
+            except KeyError:
+                max_open = 64
+            extension = tbl['extension'] or '.txt'
+
+            splits = self.prj.SplitTable(self._tablePath(tbl), tbl['name'], split_by,
+                                         extension, delimiter, max_open)
+            for key, name, path in splits:
+                split = dict(tbl)
+                del split['split_by']
+                split['name'] = name
+                split['extension'] = extension
+                split['path'] = os.path.dirname(path)
+                if 'geocoded_layer_name' in tbl:
+                    split['geocoded_layer_name'] = tbl['geocoded_layer_name'] + name[len(tbl['name']):]
+                tables.append(split)
+        return tables
 
     def _addLayersToProject(self):
         """ Adds definitions of existing spatial layer(s) to the project.
@@ -103,18 +596,19 @@ class Controller:
         This method takes data from project's config and creates Layer objects using the Layer class.
         """
         prj = self.prj
+        self._collectTaskLayers()
         for lyr in self.config.LAYERS:
             lyr = layer.Layer(lyr)
             prj.new_layers.append(lyr)
 
         prj.AddLayers()
 
-    def _runSpatialJoins(self):
-        """ Loops through any spatial joins added from config and performs the join.
-        """
-        prj = self.prj
-        for join in self.config.SPATIAL_JOINS:
-            prj.JoinSpatialTableToLayer(definition=join)
+    def _setupLegend(self):
+        self.prj.LegendStart()
+
+        self.prj.LegendPosition()
+        self.prj.LegendStyle()
+        self.prj.LegendStop()
 
 
     def _sort_layers(self):
@@ -130,19 +624,30 @@ class Controller:
 
 
     def _save_outputs(self):
-        """  Uses output mode from to set proper output list."""
+        """  Uses output mode from to set proper output list.  OUTPUT_TILES
+        are added with or without an output mode.
+        """
         try:
             output_mode = self.config.OUTPUT_MODE
         except AttributeError:
-            print('\nWARNING:  OUTPUT_MODE not set in config.  No output saved.\n')
-            return
-        print('Output mode: {}'.format(output_mode))
+            output_mode = None
+            if not self.config.OUTPUT_TILES:
+                print('\nWARNING:  OUTPUT_MODE not set in config.  No output saved.\n')
+                return
+        if output_mode is not None:
+            print('Output mode: {}'.format(output_mode))
 
         # FIXME:  This default is not suitable for use outside FRCC.  Should update logic to simply check for self.config.OUTPUT_LIST as the determining factor.
         if output_mode == 'Default':
             self.prj.outputs = get_default_outputs()
         elif output_mode == 'Custom':
-            self.prj.outputs = self.config.OUTPUT_LIST
+            try:
+                self.prj.outputs = self.config.OUTPUT_LIST
+            except AttributeError:
+                print('\nWARNING:  OUTPUT_MODE is Custom but OUTPUT_LIST is not set.\n')
+
+        if self.config.OUTPUT_TILES:
+            self.prj.outputs = list(self.prj.outputs) + self.prj.TileOutputs(self.config.OUTPUT_TILES)
 
         # Save Outputs
         if len(self.prj.outputs) == 0:
@@ -150,3 +655,149 @@ class Controller:
         else:
             self.prj.SaveOutputs()
 
+
+def run_variant(job):
+    """ Runs the map stages of one BatchController variant, used by worker
+    processes.  Returns (project name, seconds).
+    """
+    variant_config, shared, resume = job
+    start = time.time()
+    c = Controller()
+    c.config = variant_config
+    c.resume = resume
+    c.runVariant(shared)
+    return variant_config.PROJECT_NAME, time.time() - start
+
+
+class BatchController(Controller):
+    """ Runs many variants of a base Config (e.g. per campus or per term).
+
+    Stages shared by variants (table loads, geocodes and spatial joins) run
+    once into a shared GDB, then each variant builds its own MXD and outputs
+    from that data.  Variants whose data settings differ get their own
+    shared GDB.
+    """
+
+    # Config attributes used by the data stages.  Variants with the same
+    # values share loaded data.
+    DATA_SETTINGS = ('PROJECT_BASE_PATH', 'TABLES', 'SPATIAL_JOINS', 'SPATIAL_JOIN_BACKEND',
+                     'ADDRESS_LOCATOR', 'GEOCODE_CACHE', 'GEOCODE_CACHE_PATH',
+                     'GEOCODE_CACHE_MAX_AGE_DAYS', 'INCREMENTAL', 'SCRATCH')
+
+    def __init__(self, overrides=None):
+        """ `overrides` is a list of dictionaries of Config attribute -> value,
+        one per variant, applied to a copy of self.config.  Each variant must
+        set a unique PROJECT_NAME.
+        """
+        Controller.__init__(self)
+        if overrides is None:
+            overrides = list()
+        self.overrides = overrides
+        self.timings = list() # (stage name, seconds) for the shared data and each variant.
+
+    def run(self, resume=False, dry_run=False):
+        """ Runs the shared data stages, then the map stages of every variant
+        using a pool of config.BATCH_WORKERS processes.
+
+        With `dry_run` True, the base config and every variant are only
+        validated (see plan).
+        """
+        if dry_run:
+            return self.plan()
+        self.resume = resume
+        self.timings = list()
+        variants = self._variantConfigs()
+        groups = self._groupVariants(variants)
+
+        jobs = list()
+        for i, group in enumerate(groups):
+            data_config = copy.deepcopy(group[0])
+            data_config.PROJECT_NAME = self.config.PROJECT_NAME + '_Shared'
+            if len(groups) > 1:
+                data_config.PROJECT_NAME += '_%s' % (i + 1)
+            print('\nLoading shared data for %s variant(s):  %s'
+                  % (len(group), data_config.PROJECT_NAME))
+            start = time.time()
+            data = Controller()
+            data.config = data_config
+            data.resume = resume
+            shared = data.runDataStages()
+            self.timings.append((data_config.PROJECT_NAME, time.time() - start))
+            for variant_config in group:
+                jobs.append((variant_config, shared, resume))
+
+        workers = min(self.config.BATCH_WORKERS, len(jobs))
+        if workers > 1:
+            print('\nRunning %s variants using %s worker processes.' % (len(jobs), workers))
+            pool = multiprocessing.Pool(processes=workers)
+            try:
+                for name, seconds in pool.imap_unordered(run_variant, jobs):
+                    print('\nVariant complete:  %s' % (name))
+                    self.timings.append((name, seconds))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                self.timings.append(run_variant(job))
+        self._printTimings()
+
+    def plan(self):
+        """ Plans the base config and each variant without side effects.
+        Returns the problems found, variant problems are prefixed with the
+        variant's PROJECT_NAME.
+        """
+        problems = Controller.plan(self)
+        try:
+            variants = self._variantConfigs()
+        except ValueError as e:
+            problems.append('%s' % (e))
+            return problems
+        for variant_config in variants:
+            print('\nVariant:  %s' % (variant_config.PROJECT_NAME))
+            variant = Controller()
+            variant.config = variant_config
+            problems.extend(['%s:  %s' % (variant_config.PROJECT_NAME, problem)
+                             for problem in variant.plan()])
+        return problems
+
+    def _variantConfigs(self):
+        variants = list()
+        names = set()
+        for override in self.overrides:
+            variant_config = copy.deepcopy(self.config)
+            for name, value in override.items():
+                setattr(variant_config, name, value)
+            if variant_config.PROJECT_NAME in names:
+                raise ValueError('Variant PROJECT_NAME "%s" is not unique, variants would '
+                                 'overwrite each other.' % (variant_config.PROJECT_NAME))
+            names.add(variant_config.PROJECT_NAME)
+            # Pool workers can not start processes of their own.
+            if self.config.BATCH_WORKERS > 1:
+                variant_config.OUTPUT_WORKERS = 1
+                variant_config.TASK_WORKERS = 1
+            variants.append(variant_config)
+        return variants
+
+    def _groupVariants(self, variants):
+        """ Returns lists of variants sharing the same data settings. """
+        groups = list()
+        keys = dict()
+        for variant_config in variants:
+            # Generalized layers are built with the shared data.
+            generalized = [lyr for lyr in variant_config.LAYERS if lyr.get('generalize')]
+            key = manifest.definition_hash([getattr(variant_config, name, None)
+                                            for name in self.DATA_SETTINGS], generalized)
+            if key not in keys:
+                keys[key] = len(groups)
+                groups.append(list())
+            groups[keys[key]].append(variant_config)
+        return groups
+
+    def _printTimings(self):
+        total = 0.0
+        print('\nBatch timings:')
+        for name, seconds in self.timings:
+            total += seconds
+            print('  %8.2fs  %s' % (seconds, name))
+        print('  %8.2fs  Total' % (total))
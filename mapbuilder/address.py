@@ -0,0 +1,60 @@
+""" The address module contains helpers to normalize address values so
+equivalent addresses produce the same key.
+"""
+import re
+
+_WHITESPACE = re.compile(r'\s+')
+_PUNCTUATION = re.compile(r'[.,]')
+
+# Common street words mapped to USPS standard abbreviations.
+STREET_ABBREVIATIONS = {'NORTH': 'N', 'SOUTH': 'S', 'EAST': 'E', 'WEST': 'W',
+                        'NORTHEAST': 'NE', 'NORTHWEST': 'NW',
+                        'SOUTHEAST': 'SE', 'SOUTHWEST': 'SW',
+                        'AVENUE': 'AVE', 'AV': 'AVE',
+                        'BOULEVARD': 'BLVD',
+                        'CIRCLE': 'CIR',
+                        'COURT': 'CT',
+                        'DRIVE': 'DR',
+                        'HIGHWAY': 'HWY',
+                        'LANE': 'LN',
+                        'PARKWAY': 'PKWY',
+                        'PLACE': 'PL',
+                        'ROAD': 'RD',
+                        'STREET': 'ST', 'STR': 'ST',
+                        'TERRACE': 'TER',
+                        'TRAIL': 'TRL',
+                        'APARTMENT': 'APT',
+                        'BUILDING': 'BLDG',
+                        'SUITE': 'STE'}
+
+
+def normalize(value):
+    """ Returns `value` as an upper case string with whitespace collapsed.
+
+    None becomes an empty string and whole number floats (e.g. Zip codes read
+    as Double) lose their decimal.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    try:
+        value = value.strip()
+    except AttributeError:
+        value = str(value)
+    return _WHITESPACE.sub(' ', value).strip().upper()
+
+
+def normalize_street(value):
+    """ Returns a normalized street line with periods and commas removed and
+    common words replaced by their standard abbreviation, e.g.
+    "920 12th Street" and "920 12TH ST." both become "920 12TH ST".
+    """
+    value = _PUNCTUATION.sub(' ', normalize(value))
+    words = [STREET_ABBREVIATIONS.get(word, word) for word in value.split()]
+    return ' '.join(words)
+
+
+def address_key(street, city, state, zip_code):
+    """ Returns the normalized (Street, City, State, Zip) tuple for an address. """
+    return (normalize_street(street), normalize(city), normalize(state), normalize(zip_code))
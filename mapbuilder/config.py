@@ -28,10 +28,110 @@ class Config:
         self.LEGEND_Y = 0.3768
 
         # Start with empty lists for optional parameters
+        ## A table definition with a "split_by" column is split into one table
+        ## per value of that column, named <name>_<value>.
+        ## A layer definition with "generalize" (True, or a list of tolerances
+        ## in the layer's units) gets simplified copies in the project GDB, each
+        ## output draws the coarsest copy within one printed dot at its scale.
         self.TABLES = list()
         self.LAYERS = list()
         self.SPATIAL_JOINS = list()
         self.SORT = list()
 
+        # Tiled outputs, added after the outputs set by OUTPUT_MODE.  An atlas
+        # of tiles only does not need OUTPUT_MODE or OUTPUT_LIST.
+        ## Each definition is a grid over a bounding box, e.g.
+        ##   {'name': 'County Atlas', 'xmin': ..., 'ymin': ..., 'xmax': ..., 'ymax': ...,
+        ##    'tile_size': 0.05}  (or 'rows' and 'columns')
+        ## or one output per feature of a polygon feature class, e.g.
+        ##   {'name': 'Campus', 'path': 'C:\\Path\\To\\Campuses.shp', 'name_field': 'NAME'}
+        ## Tiles without features in the visible layers (or the 'layers' listed)
+        ## are skipped unless 'skip_empty' is False.  See mapbuilder/tiles.py.
+        self.OUTPUT_TILES = list()
+
+        # Spatial join backend, can be overridden per join with the "backend" key.
+        ## 'arcpy' uses SpatialJoin_analysis, 'numpy' runs an indexed point in
+        ## polygon join and only writes polygons containing points.
+        self.SPATIAL_JOIN_BACKEND = 'arcpy'
+
+        # Incremental builds - Reuse the project GDB and MXD, skipping stages
+        # whose inputs have not changed since the last run.
+        self.INCREMENTAL = False
+
+        # Record completed table loads, geocodes, spatial joins and outputs in
+        # a checkpoint file, so a run that stops part way can continue with
+        # c.run(resume=True).  Resuming also records a checkpoint.
+        self.CHECKPOINT = False
+
+        # Apply each style file to all of its layers in one pass.
+        self.STYLE_BATCH = False
+
+        # Write the MXD after every step instead of once per run (debugging).
+        self.SAVE_EVERY_STEP = False
+
+        # Number of worker processes used to export outputs (PDF).
+        ## Note:  Values above 1 export in parallel, bootstrap scripts must then
+        ##      guard c.run() with:  if __name__ == '__main__':
+        self.OUTPUT_WORKERS = 1
+
+        # Number of worker processes used for GDB tasks (table loads, geocodes
+        # and spatial joins) that do not depend on each other.  MXD changes
+        # always run in the main process.
+        ## Note:  Values above 1 also require the __main__ guard.
+        ## Geocodes run in the main process when GEOCODE_CACHE is on or the
+        ## table is sharded (geocode_workers above 1).  Workers write separate
+        ## datasets to the same file GDB, keep TASK_WORKERS low (2-4) to avoid
+        ## schema lock errors on slow or network drives.
+        self.TASK_WORKERS = 1
+
+        # Number of worker processes BatchController uses to run variants.
+        ## Note:  Values above 1 run variants in parallel, each variant then
+        ##      exports its outputs serially and OUTPUT_WORKERS is ignored.
+        self.BATCH_WORKERS = 1
+
+        # Scratch workspace - Intermediate datasets (loaded tables, pending
+        # geocode addresses, full spatial join results) are kept in_memory
+        # instead of the project GDB.  Only datasets used as layers are written.
+        ## Tables and spatial joins can override this with a "scratch" key.
+        ## Scratch tables are loaded to the GDB when TASK_WORKERS is above 1.
+        ## in_memory does not outlive the run, so with INCREMENTAL scratch
+        ## tables are loaded again on every run even when the stages using
+        ## them are current.  Leave SCRATCH off for large tables that rarely
+        ## change.
+        self.SCRATCH = False
+
+        # Layer culling - Layers with no features in an output's extent are not
+        # drawn for that output.  With CULL_LEGEND they are removed for the
+        # export so the legend drops them too (the MXD is reopened after).
+        ## Outputs can override these with "cull_layers" and "cull_legend", and
+        ## list "keep_layers" (never culled) and "hide_layers" (always hidden).
+        self.CULL_LAYERS = False
+        self.CULL_LEGEND = False
+
+        # Render cache - Skips exporting outputs whose PDF was exported from the
+        # same extent, header/footer, template, styles, definitions and
+        # visible layer features (within the extent) by an earlier run.
+        ## Set RENDER_REFRESH to True to export every output again.
+        ## Note:  A reused PDF keeps the "Generated" date of its original export.
+        self.RENDER_CACHE = False
+        self.RENDER_REFRESH = False
+
+        # Trace - Records the time spent in each stage, Project method, ArcPy
+        # call and output export, and the row count of each dataset built.
+        ## TRACE_PATH defaults to <PROJECT_NAME>_trace.json in the Output folder.
+        ## TRACE_FORMAT is 'json' or 'chrome' (chrome://tracing).
+        ## TRACE_HOOKS are called with each event, e.g. to forward metrics.
+        self.TRACE = False
+        self.TRACE_PATH = None
+        self.TRACE_FORMAT = 'json'
+        self.TRACE_HOOKS = list()
+
         # Local Geocoder Location
         self.ADDRESS_LOCATOR = "C:\\ArcGIS\\Locator_2010\\Street_Addresses_US.loc"
+
+        # Geocode cache - Keeps geocoding results between runs so only new or
+        # changed addresses are sent to the locator.
+        ## Note:  GEOCODE_CACHE_PATH defaults to a SQLite file next to the project MXD.
+        self.GEOCODE_CACHE = False
+        self.GEOCODE_CACHE_PATH = None
+        self.GEOCODE_CACHE_MAX_AGE_DAYS = 180
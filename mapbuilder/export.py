@@ -0,0 +1,159 @@
+""" The export module contains helpers used to save project outputs (PDF).
+
+The helpers work against any MapDocument, so the same logic is used when the
+project exports serially and when outputs are exported by worker processes.
+"""
+import os
+import time
+from lazy import arcpy
+import generalize
+
+
+def output_filename(output, output_prefix=None):
+    """ Returns the PDF file name for an output definition. """
+    if output_prefix:
+        output_name = output_prefix + ' - ' + output['name']
+    else:
+        output_name = output['name']
+    return output_name + '.pdf'
+
+
+def header_text(header_prefix, line2_text):
+    """ Returns the formatted text for the txtHeader element. """
+    text = '<FNT size="18"><BOL>Front Range Community College</BOL></FNT>'
+    text += '\r\n<FNT size="14"><BOL>%s</BOL></FNT>' % (header_prefix)
+    text += '\r\n<FNT size="14">%s</FNT>' % (line2_text)
+    return text
+
+
+def set_extent(dataframe, output):
+    """ Sets the dataframe's extent using the output's bounding box. """
+    extent = dataframe.extent
+    extent.XMin = output['xmin']
+    extent.YMin = output['ymin']
+    extent.XMax = output['xmax']
+    extent.YMax = output['ymax']
+    dataframe.extent = extent
+
+
+def drawn_extent(dataframe, output):
+    """ Sets the dataframe's extent for `output` and returns the extent
+    ArcMap actually draws as (xmin, ymin, xmax, ymax).  This is wider than the
+    output's bounding box when their aspect ratios differ.
+    """
+    set_extent(dataframe, output)
+    extent = dataframe.extent
+    return (extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+
+
+def layout_elements(mxd):
+    """ Returns a dictionary of element type -> layout elements of that type
+    for the MXD, in the order listed, using a single ListLayoutElements call.
+    """
+    elements = dict()
+    for element in arcpy.mapping.ListLayoutElements(mxd):
+        elements.setdefault(element.type, list()).append(element)
+    return elements
+
+
+def find_elements(elements, element_type, name=None):
+    """ Returns the elements of `element_type` in a layout_elements()
+    registry, only those named `name` when it is given.
+    """
+    return [element for element in elements.get(element_type, list())
+            if name is None or element.name == name]
+
+
+def set_header_text(elements, header_prefix, line2_text):
+    for txt in find_elements(elements, 'TEXT_ELEMENT', 'txtHeader'):
+        txt.text = header_text(header_prefix, line2_text)
+
+
+def set_footer_text(elements, copyright_text):
+    for txt in find_elements(elements, 'TEXT_ELEMENT', 'txtLowerLeft'):
+        txt.text = copyright_text
+    for txt in find_elements(elements, 'TEXT_ELEMENT', 'txtLowerRight'):
+        txt.text = 'Generated:  <dyn format="short" type="date">'
+
+
+def hide_layers(mxd, dataframe, names, remove=False):
+    """ Switches off the visible layers named in `names` and returns them,
+    for restore_layers().
+
+    With `remove` the layers are removed from the data frame instead, so the
+    legend drops their entries as well.  Removed layers can not be restored,
+    the MXD must be opened again from disk.
+    """
+    hidden = list()
+    for lyr in arcpy.mapping.ListLayers(mxd, '*', dataframe):
+        if lyr.name in names and lyr.visible and not lyr.isGroupLayer:
+            if remove:
+                arcpy.mapping.RemoveLayer(dataframe, lyr)
+            else:
+                lyr.visible = False
+                hidden.append(lyr)
+    return hidden
+
+
+def restore_layers(hidden):
+    for lyr in hidden:
+        lyr.visible = True
+
+
+def export_output(mxd, dataframe, elements, output, output_path, header_prefix,
+                  generalized=None, current=None, hidden=None, remove_hidden=False):
+    """ Exports one output to PDF and returns the elapsed seconds.
+
+    `generalized` and `current` (see generalize.set_levels) switch
+    generalized layers to the level drawn at the output's scale.  Layers
+    named in `hidden` are not drawn (see hide_layers), they are switched on
+    again after the export unless `remove_hidden` removed them.
+    """
+    start = time.time()
+    set_extent(dataframe, output)
+    if generalized:
+        generalize.set_levels(mxd, dataframe, output, generalized, current)
+    switched_off = list()
+    if hidden:
+        switched_off = hide_layers(mxd, dataframe, hidden, remove_hidden)
+    try:
+        set_header_text(elements, header_prefix, output['name'])
+        arcpy.mapping.ExportToPDF(mxd, output_path)
+    finally:
+        restore_layers(switched_off)
+    return time.time() - start
+
+
+# MapDocument opened by init_worker() in each worker process.
+_worker_state = dict()
+
+
+def init_worker(mxd_path, header_prefix, generalized=None):
+    """ Opens a read-only copy of the project MXD once per worker process. """
+    mxd = arcpy.mapping.MapDocument(mxd_path)
+    _worker_state['mxd_path'] = mxd_path
+    _worker_state['mxd'] = mxd
+    _worker_state['dataframe'] = arcpy.mapping.ListDataFrames(mxd, "*")[0]
+    _worker_state['elements'] = layout_elements(mxd)
+    _worker_state['header_prefix'] = header_prefix
+    _worker_state['generalized'] = generalized
+    _worker_state['current'] = dict()
+
+
+def export_worker(job):
+    """ Exports one output using the worker's copy of the project MXD.
+
+    Runs in a worker process started with init_worker().  `job` is an
+    (index, output, output_path, hidden layer names, remove hidden) tuple.
+    Returns an (index, output_filename, seconds) tuple.  The MXD is never
+    saved by the worker, it is opened again after layers were removed.
+    """
+    index, output, output_path, hidden, remove_hidden = job
+    seconds = export_output(_worker_state['mxd'], _worker_state['dataframe'],
+                            _worker_state['elements'], output, output_path,
+                            _worker_state['header_prefix'], _worker_state['generalized'],
+                            _worker_state['current'], hidden, remove_hidden)
+    if hidden and remove_hidden:
+        init_worker(_worker_state['mxd_path'], _worker_state['header_prefix'],
+                    _worker_state['generalized'])
+    return (index, os.path.basename(output_path), seconds)
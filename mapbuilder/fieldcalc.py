@@ -0,0 +1,76 @@
+""" The fieldcalc module adds several calculated fields to a table at once
+using NumPy: the input columns are read in a single pass, each new column is
+computed by a vectorized Python callable, and all new columns are written
+back with a single ExtendTable call.
+"""
+import time
+import numpy
+from lazy import arcpy
+
+# Maps AddField_management data types to NumPy dtypes.  TEXT uses the field
+# definition's "length" (default 255).
+DTYPES = {'SHORT': '<i2',
+          'LONG': '<i4',
+          'FLOAT': '<f4',
+          'DOUBLE': '<f8',
+          'TEXT': '<U%s'}
+
+JOIN_FIELD = 'MB_JOIN_OID'
+
+
+def field_dtype(field):
+    try:
+        data_type = field['type'].upper()
+        dtype = DTYPES[data_type]
+    except KeyError:
+        raise ValueError('Unsupported type for calculated field "%s", use one of: %s'
+                         % (field['name'], ', '.join(sorted(DTYPES))))
+    if data_type == 'TEXT':
+        dtype = dtype % (field.get('length', 255))
+    return dtype
+
+
+def calculate_fields(table_path, fields, null_values=None):
+    """ Adds the calculated `fields` to `table_path`.
+
+    Each field is a dictionary with the keys:
+        * name
+        * type - SHORT, LONG, FLOAT, DOUBLE or TEXT
+        * inputs - Names of the fields the calculation reads
+        * calc - Callable taking the input columns (a NumPy structured array,
+          indexed by field name) and returning one value per row
+        * alias - Optional
+        * length - Optional, TEXT fields only
+
+    `null_values` maps input field names to the value used for nulls.
+    Returns a list of (step, seconds) timings.
+    """
+    timings = list()
+    inputs = list()
+    for field in fields:
+        for name in field['inputs']:
+            if name not in inputs:
+                inputs.append(name)
+
+    start = time.time()
+    columns = arcpy.da.TableToNumPyArray(table_path, ['OID@'] + inputs,
+                                         null_value=null_values)
+    timings.append(('read %s rows' % (len(columns)), time.time() - start))
+
+    dtype = [(JOIN_FIELD, '<i4')] + [(str(f['name']), field_dtype(f)) for f in fields]
+    results = numpy.zeros(len(columns), dtype=dtype)
+    results[JOIN_FIELD] = columns['OID@']
+    for field in fields:
+        start = time.time()
+        results[field['name']] = field['calc'](columns)
+        timings.append((field['name'], time.time() - start))
+
+    start = time.time()
+    oid_field = arcpy.Describe(table_path).OIDFieldName
+    arcpy.da.ExtendTable(table_path, oid_field, results, JOIN_FIELD, append_only=False)
+    for field in fields:
+        if field.get('alias'):
+            arcpy.AlterField_management(table_path, field['name'],
+                                        new_field_alias=field['alias'])
+    timings.append(('write %s fields' % (len(fields)), time.time() - start))
+    return timings
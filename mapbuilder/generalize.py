@@ -0,0 +1,132 @@
+""" The generalize module writes simplified copies of polygon and line feature
+classes and picks the copy each output draws.
+
+A copy is drawn when its tolerance is at most the ground size of one printed
+dot at the output's scale, so the simplification is not visible in the PDF
+while far fewer vertices are rendered and embedded.
+"""
+import os
+from lazy import arcpy
+
+DPI = 300 # Resolution ExportToPDF uses by default.
+
+
+def default_tolerances(width, height, page_inches=8.0, levels=3):
+    """ Returns ascending tolerances for a layer of the given extent:  the
+    size of one printed dot when the whole layer fills `page_inches`, and at
+    4x, 16x... zoom for each additional level.
+    """
+    dot = max(width, height) / (page_inches * DPI)
+    return [dot / 4 ** i for i in reversed(range(levels))]
+
+
+def generalize_features(in_path, out_path, tolerance):
+    """ Copies `in_path` to `out_path` with each geometry generalized to
+    `tolerance` (in the data's units).  Geometries that would collapse are
+    kept as they are.
+
+    Returns the vertex counts before and after.
+    """
+    if arcpy.Exists(out_path):
+        arcpy.Delete_management(out_path)
+    arcpy.CopyFeatures_management(in_path, out_path)
+    before = 0
+    after = 0
+    with arcpy.da.UpdateCursor(out_path, ['SHAPE@']) as cursor:
+        for row in cursor:
+            shape = row[0]
+            if shape is None:
+                continue
+            before += shape.pointCount
+            simplified = shape.generalize(tolerance)
+            if simplified is None or simplified.pointCount == 0:
+                after += shape.pointCount
+                continue
+            after += simplified.pointCount
+            cursor.updateRow([simplified])
+    return before, after
+
+
+def level_path(output, page_size, levels):
+    """ Returns the path of the most generalized level that is within one
+    printed dot for `output`, or None for full resolution.
+
+    `page_size` is the data frame's (width, height) in inches and `levels`
+    a list of (tolerance, path) tuples.  The output's bounds must be in the
+    same units as the tolerances (see layer_bounds).
+    """
+    units_per_dot = max((output['xmax'] - output['xmin']) / page_size[0],
+                        (output['ymax'] - output['ymin']) / page_size[1]) / DPI
+    path = None
+    for tolerance, candidate in sorted(levels):
+        if tolerance <= units_per_dot:
+            path = candidate
+    return path
+
+
+def layer_bounds(output, dataframe, spatial_reference):
+    """ Returns the bounds of `output`, given in the data frame's coordinate
+    system, projected to the layer's `spatial_reference` (an exported
+    string) so they compare with the layer's tolerances.
+    """
+    layer_sr = arcpy.SpatialReference()
+    layer_sr.loadFromString(spatial_reference)
+    corners = [(output['xmin'], output['ymin']), (output['xmin'], output['ymax']),
+               (output['xmax'], output['ymax']), (output['xmax'], output['ymin'])]
+    box = arcpy.Polygon(arcpy.Array([arcpy.Point(x, y) for x, y in corners]),
+                        dataframe.spatialReference)
+    extent = box.projectAs(layer_sr).extent
+    return {'xmin': extent.XMin, 'ymin': extent.YMin, 'xmax': extent.XMax, 'ymax': extent.YMax}
+
+
+def _workspace(path):
+    """ Returns the workspace, workspace type (for replaceDataSource) and
+    dataset name of the feature class at `path`.  Feature classes in a
+    feature dataset use the geodatabase as their workspace.
+    """
+    desc = arcpy.Describe(path)
+    dataset = desc.name
+    workspace = arcpy.Describe(desc.path)
+    if workspace.dataType == 'FeatureDataset':
+        workspace = arcpy.Describe(workspace.path)
+    if workspace.workspaceType == 'RemoteDatabase':
+        workspace_type = 'SDE_WORKSPACE'
+    elif workspace.workspaceType == 'LocalDatabase':
+        if os.path.splitext(workspace.catalogPath)[1].lower() == '.mdb':
+            workspace_type = 'ACCESS_WORKSPACE'
+        else:
+            workspace_type = 'FILEGDB_WORKSPACE'
+    else:
+        workspace_type = 'SHAPEFILE_WORKSPACE'
+        dataset = desc.baseName
+    return workspace.catalogPath, workspace_type, dataset
+
+
+def _replace_data_source(mxd, dataframe, layer_name, path):
+    workspace, workspace_type, dataset = _workspace(path)
+    for lyr in arcpy.mapping.ListLayers(mxd, layer_name, dataframe):
+        lyr.replaceDataSource(workspace, workspace_type, dataset, False)
+
+
+def set_levels(mxd, dataframe, output, generalized, current):
+    """ Points each generalized layer at the level drawn for `output`.
+
+    `generalized` maps layer name -> {'original': path, 'levels': [(tolerance,
+    path), ...], 'spatial_reference': the layer's, exported} and `current` maps layer name -> the level path in use
+    (None or missing for the original), it is updated.
+    """
+    page_size = (dataframe.elementWidth, dataframe.elementHeight)
+    for name, definition in generalized.items():
+        bounds = layer_bounds(output, dataframe, definition['spatial_reference'])
+        path = level_path(bounds, page_size, definition['levels'])
+        if path != current.get(name):
+            _replace_data_source(mxd, dataframe, name, path or definition['original'])
+            current[name] = path
+
+
+def restore(mxd, dataframe, generalized, current):
+    """ Points generalized layers back at their original data. """
+    for name, path in list(current.items()):
+        if path is not None:
+            _replace_data_source(mxd, dataframe, name, generalized[name]['original'])
+        current[name] = None
@@ -0,0 +1,127 @@
+""" The geocache module contains a GeocodeCache class that stores geocoding
+results on disk (SQLite) so unchanged addresses are not sent to the locator
+again on later runs.
+"""
+import os
+import sqlite3
+import time
+
+
+def locator_version(locator_path):
+    """ Returns a version string for the locator based on its file size and
+    modified time.  Rebuilding the locator changes the version, which keeps
+    results from an older locator from being reused.
+    """
+    try:
+        stat = os.stat(locator_path)
+    except OSError:
+        return 'unknown'
+    return '%s-%s' % (stat.st_size, int(stat.st_mtime))
+
+
+class GeocodeCache(object):
+    """ Geocoding results keyed by locator, locator version and the normalized
+    (Street, City, State, Zip) address tuple.
+
+    Unmatched addresses are stored too (with no coordinates) so they are not
+    retried on every run.
+    """
+
+    def __init__(self, path, locator_path, version=None, max_age_days=None):
+        self.path = path
+        self.locator_path = locator_path
+        if version is None:
+            version = locator_version(locator_path)
+        self.locator_version = version
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        self._conn = sqlite3.connect(path)
+        self._createTables()
+        if max_age_days:
+            self.evict(max_age_days)
+
+    def lookup(self, addresses):
+        """ Returns a dictionary of address key -> (x, y, status, score) for
+        the addresses found in the cache.
+        """
+        sql = ('SELECT x, y, status, score FROM geocode_cache'
+               ' WHERE locator = ? AND locator_version = ?'
+               ' AND street = ? AND city = ? AND state = ? AND zip = ?')
+        cursor = self._conn.cursor()
+        found = dict()
+        for address in addresses:
+            cursor.execute(sql, (self.locator_path, self.locator_version) + tuple(address))
+            row = cursor.fetchone()
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                found[address] = row
+        return found
+
+    def store(self, results, spatial_reference):
+        """ Saves geocoding results.
+
+        `results` is a dictionary of address key -> (x, y, status, score) and
+        `spatial_reference` is the locator's output spatial reference string.
+        """
+        now = time.time()
+        rows = list()
+        for address, location in results.items():
+            rows.append((self.locator_path, self.locator_version) + tuple(address)
+                        + tuple(location) + (now,))
+        self._conn.executemany('INSERT OR REPLACE INTO geocode_cache'
+                               ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self._conn.execute('INSERT OR REPLACE INTO geocode_locator VALUES (?, ?, ?)',
+                           (self.locator_path, self.locator_version, spatial_reference))
+        self._conn.commit()
+        self.stored += len(rows)
+
+    def spatial_reference(self):
+        """ Returns the stored spatial reference string for the locator, or None. """
+        row = self._conn.execute('SELECT spatial_reference FROM geocode_locator'
+                                 ' WHERE locator = ? AND locator_version = ?',
+                                 (self.locator_path, self.locator_version)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def evict(self, max_age_days):
+        """ Removes results geocoded more than `max_age_days` ago.  Returns the
+        number of results removed.
+        """
+        cutoff = time.time() - (max_age_days * 86400)
+        cursor = self._conn.execute('DELETE FROM geocode_cache WHERE geocoded_at < ?',
+                                    (cutoff,))
+        self._conn.commit()
+        self.evicted += cursor.rowcount
+        return cursor.rowcount
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        if lookups:
+            hit_rate = 100.0 * self.hits / lookups
+        else:
+            hit_rate = 0.0
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': hit_rate,
+                'stored': self.stored,
+                'evicted': self.evicted}
+
+    def close(self):
+        self._conn.close()
+
+    def _createTables(self):
+        self._conn.execute('CREATE TABLE IF NOT EXISTS geocode_cache ('
+                           ' locator TEXT, locator_version TEXT,'
+                           ' street TEXT, city TEXT, state TEXT, zip TEXT,'
+                           ' x REAL, y REAL, status TEXT, score REAL,'
+                           ' geocoded_at REAL,'
+                           ' PRIMARY KEY (locator, locator_version, street, city, state, zip))')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS geocode_locator ('
+                           ' locator TEXT, locator_version TEXT, spatial_reference TEXT,'
+                           ' PRIMARY KEY (locator, locator_version))')
+        self._conn.commit()
@@ -0,0 +1,222 @@
+""" The geocode module contains the ArcPy steps used to geocode a set of unique
+addresses and write the results back to every row of a table.
+"""
+import os
+import multiprocessing
+from lazy import arcpy
+import address
+
+# (Locator field, Table field) pairs used to geocode project tables.
+ADDRESS_FIELDS = [('Street', 'street_1'),
+                  ('City', 'city'),
+                  ('State', 'state'),
+                  ('Zip', 'zip')]
+
+KEY_FIELD = 'MB_ADDR_ID'
+
+# Maps arcpy Field.type values to AddField_management data types.
+FIELD_TYPES = {'SmallInteger': 'SHORT',
+               'Integer': 'LONG',
+               'Single': 'FLOAT',
+               'Double': 'DOUBLE',
+               'String': 'TEXT',
+               'Date': 'DATE',
+               'Guid': 'GUID'}
+
+
+def address_field_map(address_fields=ADDRESS_FIELDS):
+    """ Returns the field map string used by GeocodeAddresses_geocoding. """
+    return '; '.join(['%s %s' % (locator_field, table_field)
+                      for locator_field, table_field in address_fields])
+
+
+def geocode(table, address_locator, address_fields, out_feature_class,
+            shard_size=None, workers=1, scratch_path=None):
+    """ Geocodes `table` to `out_feature_class`.
+
+    When `shard_size` is set, `workers` is above 1 and the table has more
+    rows than `shard_size`, the table is split into row-range shards
+    geocoded by `workers` processes, each in its own scratch GDB under
+    `scratch_path`.  With one worker the table is geocoded in this process.
+    """
+    if shard_size and workers > 1:
+        with arcpy.da.SearchCursor(table, ['OID@']) as cursor:
+            oids = sorted([row[0] for row in cursor])
+        ranges = shard_ranges(oids, shard_size)
+        if len(ranges) > 1:
+            geocode_sharded(table, address_locator, address_fields,
+                            out_feature_class, ranges, workers, scratch_path)
+            return
+    arcpy.GeocodeAddresses_geocoding(table,
+                                     address_locator,
+                                     address_fields,
+                                     out_feature_class)
+
+
+def shard_ranges(oids, shard_size):
+    """ Splits sorted object ids into (first, last) ranges of at most
+    `shard_size` rows each.
+    """
+    ranges = list()
+    for start in range(0, len(oids), shard_size):
+        shard = oids[start:start + shard_size]
+        ranges.append((shard[0], shard[-1]))
+    return ranges
+
+
+def geocode_sharded(table, address_locator, address_fields, out_feature_class,
+                    ranges, workers, scratch_path):
+    """ Geocodes each (first, last) object id range of `table` in a worker
+    process and merges the shard outputs, in range order, into
+    `out_feature_class`.
+    """
+    if not os.path.exists(scratch_path):
+        os.makedirs(scratch_path)
+    oid_field = arcpy.AddFieldDelimiters(table, arcpy.Describe(table).OIDFieldName)
+    out_name = os.path.basename(out_feature_class)
+    jobs = list()
+    for i, (first, last) in enumerate(ranges):
+        where_clause = '%s >= %s AND %s <= %s' % (oid_field, first, oid_field, last)
+        jobs.append({'table': table,
+                     'where_clause': where_clause,
+                     'address_locator': address_locator,
+                     'address_fields': address_fields,
+                     'scratch_gdb': os.path.join(scratch_path, '%s_shard_%03d.gdb' % (out_name, i))})
+
+    workers = max(1, min(workers, len(jobs)))
+    print('\nGeocoding %s shards of %s using %s worker processes.' % (len(jobs), table, workers))
+    pool = multiprocessing.Pool(processes=workers)
+    try:
+        shard_outputs = pool.map(geocode_shard, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    _delete_if_exists(out_feature_class)
+    arcpy.Merge_management(shard_outputs, out_feature_class)
+    for job in jobs:
+        _delete_if_exists(job['scratch_gdb'])
+
+
+def geocode_shard(job):
+    """ Copies one row range of a table to a scratch GDB and geocodes it.
+
+    Runs in a worker process.  Returns the path of the shard's geocoded
+    feature class.
+    """
+    scratch_gdb = job['scratch_gdb']
+    _delete_if_exists(scratch_gdb)
+    arcpy.CreateFileGDB_management(os.path.dirname(scratch_gdb), os.path.basename(scratch_gdb))
+    arcpy.TableToTable_conversion(job['table'], scratch_gdb, 'shard', job['where_clause'])
+    shard_table = os.path.join(scratch_gdb, 'shard')
+    shard_output = os.path.join(scratch_gdb, 'shard_geocoded')
+    arcpy.GeocodeAddresses_geocoding(shard_table,
+                                     job['address_locator'],
+                                     job['address_fields'],
+                                     shard_output)
+    print('Geocoded shard:  %s' % (job['where_clause']))
+    return shard_output
+
+
+def unique_addresses(table, address_fields=ADDRESS_FIELDS):
+    """ Returns the row count of `table` and the set of normalized address keys. """
+    fields = [table_field for locator_field, table_field in address_fields]
+    row_count = 0
+    addresses = set()
+    with arcpy.da.SearchCursor(table, fields) as cursor:
+        for row in cursor:
+            addresses.add(address.address_key(*row))
+            row_count += 1
+    return row_count, addresses
+
+
+def geocode_addresses(addresses, workspace, name, address_locator,
+                      shard_size=None, workers=1, scratch_path=None):
+    """ Geocodes a list of address keys through a scratch table in `workspace`.
+    Sharding options are passed to geocode().
+
+    Returns a dictionary of address key -> (x, y, status, score) and the
+    spatial reference string of the locator's output.
+    """
+    pending_name = name + '__pending'
+    pending_table = os.path.join(workspace, pending_name)
+    geocoded_fc = os.path.join(workspace, pending_name + '_geocoded')
+    _delete_if_exists(pending_table)
+    _delete_if_exists(geocoded_fc)
+
+    arcpy.CreateTable_management(workspace, pending_name)
+    arcpy.AddField_management(pending_table, KEY_FIELD, 'LONG')
+    for locator_field, table_field in ADDRESS_FIELDS:
+        arcpy.AddField_management(pending_table, locator_field, 'TEXT', '', '', 255)
+
+    insert_fields = [KEY_FIELD] + [locator_field for locator_field, table_field in ADDRESS_FIELDS]
+    with arcpy.da.InsertCursor(pending_table, insert_fields) as cursor:
+        for i, key in enumerate(addresses):
+            cursor.insertRow((i,) + tuple(key))
+
+    field_map = address_field_map([(f, f) for f, table_field in ADDRESS_FIELDS])
+    geocode(pending_table, address_locator, field_map, geocoded_fc,
+            shard_size, workers, scratch_path)
+
+    results = dict()
+    with arcpy.da.SearchCursor(geocoded_fc, [KEY_FIELD, 'SHAPE@XY', 'Status', 'Score']) as cursor:
+        for key_id, xy, status, score in cursor:
+            x, y = xy
+            if x is None or y is None:
+                x, y = None, None
+            results[addresses[key_id]] = (x, y, status, score)
+
+    spatial_reference = arcpy.Describe(geocoded_fc).spatialReference.exportToString()
+    _delete_if_exists(pending_table)
+    _delete_if_exists(geocoded_fc)
+    return results, spatial_reference
+
+
+def write_geocoded(table, out_feature_class, locations, spatial_reference,
+                   address_fields=ADDRESS_FIELDS):
+    """ Creates a point feature class with every row from `table`.
+
+    Each row is located using `locations` (address key -> (x, y, status,
+    score)), rows without a location get a null shape.  Status and Score
+    fields are added to match the output of GeocodeAddresses_geocoding.
+    """
+    _delete_if_exists(out_feature_class)
+    sr = None
+    if spatial_reference:
+        sr = arcpy.SpatialReference()
+        sr.loadFromString(spatial_reference)
+    out_path, out_name = os.path.split(out_feature_class)
+    arcpy.CreateFeatureclass_management(out_path, out_name, 'POINT',
+                                        spatial_reference=sr)
+
+    field_names = list()
+    for field in arcpy.ListFields(table):
+        if field.type not in FIELD_TYPES:
+            continue
+        arcpy.AddField_management(out_feature_class, field.name,
+                                  FIELD_TYPES[field.type], field.precision,
+                                  field.scale, field.length, field.aliasName)
+        field_names.append(field.name)
+    arcpy.AddField_management(out_feature_class, 'Status', 'TEXT', '', '', 1)
+    arcpy.AddField_management(out_feature_class, 'Score', 'DOUBLE')
+
+    lower_names = [name.lower() for name in field_names]
+    key_index = [lower_names.index(table_field.lower())
+                 for locator_field, table_field in address_fields]
+
+    insert_fields = ['SHAPE@XY'] + field_names + ['Status', 'Score']
+    with arcpy.da.SearchCursor(table, field_names) as search:
+        with arcpy.da.InsertCursor(out_feature_class, insert_fields) as insert:
+            for row in search:
+                key = address.address_key(*[row[i] for i in key_index])
+                x, y, status, score = locations.get(key, (None, None, 'U', 0))
+                if x is None:
+                    xy = None
+                else:
+                    xy = (x, y)
+                insert.insertRow((xy,) + tuple(row) + (status, score))
+
+
+def _delete_if_exists(path):
+    if arcpy.Exists(path):
+        arcpy.Delete_management(path)
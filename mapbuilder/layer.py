@@ -31,5 +31,12 @@ class Layer(object):
         try:
             self.definition_query = definition['definition_query']
         except KeyError:
-            self.definition_query = None    
+            self.definition_query = None
+
+        # Generalized copies drawn at smaller scales:  True for default tolerances,
+        # or a list of tolerances in the layer's units.  Polygon and line layers only.
+        try:
+            self.generalize = definition['generalize']
+        except KeyError:
+            self.generalize = False    
 
@@ -0,0 +1,35 @@
+""" The lazy module delays importing ArcPy until it is first used.
+
+Importing ArcPy starts ArcGIS and checks out a license, which takes several
+seconds.  Modules import the `arcpy` proxy from here instead, so validating
+or planning a project (Controller.plan) never imports ArcPy at all.
+"""
+import importlib
+
+
+class LazyModule(object):
+    """ Stands in for a module, importing it on the first attribute access. """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._hook = None # Called with (qualified name, attribute), returns what to use instead.
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        value = getattr(self._module, attr)
+        if self._hook is not None:
+            return self._hook(self._name + '.' + attr, value)
+        return value
+
+    def __repr__(self):
+        state = 'loaded' if self.loaded else 'not loaded'
+        return '<lazy module %s (%s)>' % (self._name, state)
+
+
+arcpy = LazyModule('arcpy')
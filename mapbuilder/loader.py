@@ -0,0 +1,186 @@
+""" The loader module streams large delimited text files into a GDB table in
+fixed size chunks, so memory use stays bounded regardless of file size.
+
+Column types come from the table definition's schema or are inferred from a
+sample of rows and then pinned.  Values that do not convert to the pinned
+type, or are longer than a TEXT column, are loaded as null and counted
+instead of failing the load.
+"""
+import os
+import sys
+import csv
+import time
+import datetime
+import itertools
+from lazy import arcpy
+
+TYPES = ('TEXT', 'LONG', 'DOUBLE', 'DATE')
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%Y-%m-%d %H:%M:%S', '%m/%d/%Y %H:%M:%S')
+LONG_MIN = -2147483648
+LONG_MAX = 2147483647
+
+
+def open_delimited(path):
+    if sys.version_info[0] < 3:
+        return open(path, 'rb')
+    return open(path, newline='', encoding='utf-8-sig')
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def read_rows(f, delimiter='\t'):
+    """ Returns the header and an iterator over the remaining rows of an
+    open delimited file.  Values are unicode strings.
+    """
+    reader = csv.reader(f, delimiter=delimiter)
+    header = [_decode(value).strip() for value in next(reader)]
+    header[0] = header[0].lstrip(u'\ufeff')
+    rows = ([_decode(value) for value in row] for row in reader)
+    return header, rows
+
+
+def chunks(rows, chunk_size):
+    """ Yields lists of at most `chunk_size` rows. """
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError('Unrecognized date:  %s' % (value))
+
+
+def convert(value, field_type, length=None):
+    """ Converts a text value to `field_type`.  Empty values become None and
+    values that do not convert, or TEXT values longer than `length`, raise
+    ValueError.
+    """
+    value = value.strip()
+    if value == '':
+        return None
+    if field_type == 'LONG':
+        number = int(value)
+        if number < LONG_MIN or number > LONG_MAX:
+            raise ValueError('Out of range for LONG:  %s' % (value))
+        return number
+    if field_type == 'DOUBLE':
+        return float(value)
+    if field_type == 'DATE':
+        return _parse_date(value)
+    if length is not None and len(value) > length:
+        raise ValueError('Longer than %s characters:  %s' % (length, value))
+    return value
+
+
+def infer_type(values):
+    """ Returns the narrowest of LONG, DOUBLE, DATE or TEXT that converts
+    every sample value.  Numbers with leading zeros (e.g. Zip codes) stay
+    TEXT so the zeros are kept.
+    """
+    values = [v.strip() for v in values if v.strip() != '']
+    if not values:
+        return 'TEXT'
+    for v in values:
+        if len(v) > 1 and v[0] == '0' and v[1].isdigit():
+            return 'TEXT'
+    for field_type in ('LONG', 'DOUBLE', 'DATE'):
+        try:
+            for v in values:
+                convert(v, field_type)
+        except ValueError:
+            continue
+        return field_type
+    return 'TEXT'
+
+
+def infer_schema(header, sample, schema=None):
+    """ Returns a list of (column, type, length) tuples.
+
+    `schema` maps column names to types and overrides inference.  TEXT
+    lengths are at least 255, and twice the longest sample value for
+    inferred columns, since longer values may follow the sample.
+    """
+    if schema is None:
+        schema = dict()
+    result = list()
+    for i, column in enumerate(header):
+        values = [row[i] for row in sample if i < len(row)]
+        longest = max([len(v) for v in values] or [0])
+        if column in schema:
+            field_type = schema[column].upper()
+            if field_type not in TYPES:
+                raise ValueError('Unsupported type "%s" for column "%s", use one of: %s'
+                                 % (field_type, column, ', '.join(TYPES)))
+            length = max(255, longest)
+        else:
+            field_type = infer_type(values)
+            length = max(255, longest * 2)
+        result.append((column, field_type, length))
+    return result
+
+
+def load_table(path, gdb_path, name, chunk_size=50000, schema=None,
+               delimiter='\t', sample_rows=1000):
+    """ Streams the delimited file at `path` into a new table `name` in
+    `gdb_path`, printing progress in rows/sec after each chunk.
+
+    Returns (rows loaded, values that did not convert).
+    """
+    out_table = os.path.join(gdb_path, name)
+    if arcpy.Exists(out_table):
+        arcpy.Delete_management(out_table)
+
+    with open_delimited(path) as f:
+        header, rows = read_rows(f, delimiter)
+        sample = list(itertools.islice(rows, sample_rows))
+        columns = infer_schema(header, sample, schema)
+
+        arcpy.CreateTable_management(gdb_path, name)
+        field_names = list()
+        for column, field_type, length in columns:
+            field_name = arcpy.ValidateFieldName(column, gdb_path)
+            arcpy.AddField_management(out_table, field_name, field_type, '', '', length)
+            field_names.append(field_name)
+        print('\nStreaming %s to %s.  Schema: %s'
+              % (path, out_table, ', '.join(['%s %s' % (c[0], c[1]) for c in columns])))
+
+        types = [(field_type, length) for column, field_type, length in columns]
+        loaded = 0
+        bad_counts = [0] * len(types)
+        start = time.time()
+        with arcpy.da.InsertCursor(out_table, field_names) as cursor:
+            for chunk in chunks(itertools.chain(sample, rows), chunk_size):
+                for row in chunk:
+                    values = list()
+                    for i, (field_type, length) in enumerate(types):
+                        try:
+                            values.append(convert(row[i], field_type, length))
+                        except (ValueError, IndexError):
+                            values.append(None)
+                            bad_counts[i] += 1
+                    cursor.insertRow(values)
+                loaded += len(chunk)
+                elapsed = max(time.time() - start, 1e-6)
+                print('  %s rows loaded, %.0f rows/sec' % (loaded, loaded / elapsed))
+
+    bad_values = sum(bad_counts)
+    if bad_values:
+        print('  WARNING:  %s values did not match the column type or length and were loaded as null.'
+              % (bad_values))
+        for (column, field_type, length), count in zip(columns, bad_counts):
+            if count:
+                if field_type == 'TEXT':
+                    field_type = 'TEXT(%s)' % (length)
+                print('    %s %s:  %s values' % (column, field_type, count))
+    return loaded, bad_values
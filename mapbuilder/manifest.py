@@ -0,0 +1,143 @@
+""" The manifest module records a key (content hash of the inputs) for each
+completed pipeline stage so stages whose inputs have not changed can be
+skipped on later runs.
+"""
+import os
+import json
+import hashlib
+
+
+def definition_hash(*parts):
+    """ Returns a SHA1 hex digest for JSON serializable `parts`.  Dictionaries
+    are hashed with sorted keys so key order does not matter.
+    """
+    text = json.dumps(parts, sort_keys=True, default=repr)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def file_sha1(path, block_size=1048576):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        block = f.read(block_size)
+        while block:
+            sha1.update(block)
+            block = f.read(block_size)
+    return sha1.hexdigest()
+
+
+def gdb_root(path):
+    """ Returns the .gdb folder containing `path`, or None. """
+    while path and not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+    if path and path.lower().endswith('.gdb') and os.path.isdir(path):
+        return path
+    return None
+
+
+class Manifest(object):
+    """ Stage keys saved as JSON.
+
+    File hashes are kept with the size and modified time they were computed
+    for, so unchanged files are not read again on the next run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stages = dict()
+        self.files = dict()
+        self.complete = False
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self._load(data)
+
+    def _load(self, data):
+        self.stages = data.get('stages', dict())
+        self.files = data.get('files', dict())
+
+    def _dump(self):
+        return {'stages': self.stages, 'files': self.files}
+
+    def matches(self, unit, key):
+        return key is not None and self.stages.get(unit) == key
+
+    def record(self, unit, key):
+        self.stages[unit] = key
+        self.save()
+
+    def forget(self, unit):
+        if self.stages.pop(unit, None) is not None:
+            self.save()
+
+    def fingerprint(self, path):
+        """ Returns a fingerprint string for a file, a folder, or a dataset in a
+        file GDB (the GDB folder is fingerprinted).  Files use size, modified
+        time and SHA1 of their contents, folders use the size and modified
+        time of every file they contain.
+        """
+        if path is None:
+            return None
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            cached = self.files.get(path)
+            if cached and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+                sha1 = cached['sha1']
+            else:
+                sha1 = file_sha1(path)
+                self.files[path] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': sha1}
+            return '%s-%s-%s' % (stat.st_size, stat.st_mtime, sha1)
+
+        folder = path
+        if not os.path.isdir(folder):
+            folder = gdb_root(path)
+            if folder is None:
+                return 'missing'
+        entries = list()
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith('.lock'):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                entries.append((os.path.relpath(os.path.join(root, name), folder),
+                                stat.st_size, stat.st_mtime))
+        return definition_hash(os.path.relpath(path, folder), entries)
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._dump(), f, indent=2, sort_keys=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmp_path, self.path)
+
+
+class Checkpoint(Manifest):
+    """ Units of work completed by the current run, used to resume a run
+    that stopped before it was complete.
+    """
+
+    def _load(self, data):
+        Manifest._load(self, data)
+        self.complete = data.get('complete', False)
+
+    def _dump(self):
+        data = Manifest._dump(self)
+        data['complete'] = self.complete
+        return data
+
+    def canResume(self):
+        return bool(self.stages) and not self.complete
+
+    def reset(self):
+        """ Starts a new run, file hashes are kept. """
+        self.stages = dict()
+        self.complete = False
+        self.save()
+
+    def markComplete(self):
+        self.complete = True
+        self.save()
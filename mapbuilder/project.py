@@ -2,8 +2,25 @@
 """
 import os
 import errno
-import arcpy
+import time
+import pickle
+import multiprocessing
+import collections
+from lazy import arcpy
 import layer
+import export
+import geocode
+import geocache
+import manifest
+import spatial
+import spatialjoin
+import fieldcalc
+import trace
+import loader
+import splitter
+import tiles
+import scratch
+import generalize
 
 def make_sure_path_exists(path):
     try:
@@ -14,6 +31,15 @@ def make_sure_path_exists(path):
             raise
 
 
+def run_task(job):
+    """ Worker process entry point for GDB tasks scheduled by the Controller.
+    `job` is a pickled (project, method name, args) tuple.
+    """
+    prj, method, args = pickle.loads(job)
+    arcpy.env.overwriteOutput = True
+    return prj.RunTask(method, args)
+
+
 class Project(object):
     """Project class defines details needed for generating custom map outputs.
     """
@@ -25,11 +51,21 @@ class Project(object):
         self.description = None
         self.base_path = None
         self.template_mxd = None    #'C:\\ArcGIS\\MXD Templates\\Base-FRCC-General-v4.mxd' # FIXME:  Move this to Config.py under ./templates
+        self.template_cache = None # Opens template MXDs (see service.TemplateCache), reused between jobs.
         self.workspace_path = None
         self.data_path = None
         self.style_path = None
         self.gdb_path = None
         self._mxd = None
+        self._dataframe = None
+        self._layer_index = None # Layer name -> list of layers in the MXD's table of contents
+        self._elements = None # Layout element type -> elements, resolved once per MXD
+        self.save_every_step = False # When True, the MXD is written after each step (debugging).
+        self._dirty = False # True when the MXD has changes not yet written to disk
+        self.style_batch = False # When True, StyleLayers applies each style to all of its layers in one pass.
+        self.style_stats = {'hits': 0, 'loads': 0}
+        self._style_cache = dict() # (style path, modified time) -> style layer
+        self.spatial_join_backend = 'arcpy' # 'arcpy' (SpatialJoin_analysis) or 'numpy' (indexed point in polygon)
         self.new_tables = list() # Holding place for tables before they are loaded
         self.new_layers = list() # Holding place for layers before they are loaded
         self._tables = list() # Tables added here after they have been loaded
@@ -40,7 +76,85 @@ class Project(object):
         self.address_locator = None
         self.legend_x = 8.0703 # FIXME:  Set a default legend vaule that indicates NO LEGEND????
         self.legend_y = 0.5768
-
+        self.output_workers = 1 # Number of processes used by SaveOutputs, 1 exports serially.
+        self.output_timings = list() # (output_filename, seconds) for each output saved.
+        self.geocode_cache = False # When True, geocoding results are cached between runs.
+        self.geocode_cache_path = None # Defaults to a SQLite file next to the project MXD.
+        self.geocode_cache_max_age_days = None
+        self._geocode_cache = None
+        self.geocode_stats = dict() # Geocoded layer name -> rows, unique addresses, cached, geocoded counts
+        self.incremental = False # When True, stages whose inputs match the manifest are skipped.
+        self.manifest = None
+        self.mxd_definition = None # Definitions (tables, layers, joins, sort) that shape the MXD.
+        self.mxd_current = False # True when the existing project MXD was reused.
+        self.resume = False # When True, units completed by the stopped run are skipped.
+        self.checkpointing = False # When True, completed units are recorded so a run can be resumed.
+        self.checkpoint = None
+        self._dataset_keys = dict() # GDB dataset name -> key of the stage that built it
+        self.data_only = False # When True, data stages run without an MXD (BatchController).
+        self.shared_gdb_path = None # GDB loaded by a BatchController, used instead of the project GDB.
+        self._pending_stages = None # In worker processes, stages to record once the owner merges the result.
+        self.render_cache = False # When True, outputs whose render fingerprint is unchanged are not exported again.
+        self.render_refresh = False # When True, every output is exported and its fingerprint recorded again.
+        self.render_manifest = None
+        self._render_keys = dict() # Output filename -> render fingerprint for this run
+        self.scratch = False # Default for the "scratch" key of tables and spatial joins.
+        self.scratch_available = True # False when tasks run in worker processes, which can not share in_memory.
+        self._dataset_paths = dict() # Dataset name -> path, for datasets not in the project GDB
+        self.scratch_stats = dict() # Dataset name -> approximate bytes not written to the project GDB
+        self.generalized = dict() # Layer name -> original path and (tolerance, path) levels, see generalize.set_levels
+        self.cull_layers = False # When True, layers without features in an output's extent are not drawn.
+        self.cull_legend = False # When True, culled layers are removed for the export so the legend drops them.
+        self._layer_indexes = None # Layer name -> GridIndex of feature bounding boxes, built once for culling
+        self._layer_features = dict() # (name, data source, query) -> feature bounding boxes and digests, see _layerFeatures
+
+
+    def __getstate__(self):
+        """ Drops the MXD, its ArcPy objects and open caches so a copy of the
+        project can be sent to worker processes.
+        """
+        state = self.__dict__.copy()
+        state['_mxd'] = None
+        state['_dataframe'] = None
+        state['_layer_index'] = None
+        state['_elements'] = None
+        state['_style_cache'] = dict()
+        state['_geocode_cache'] = None
+        state['template_cache'] = None
+        state['_layer_indexes'] = None
+        state['_layer_features'] = dict()
+        return state
+
+    def RunTask(self, method, args):
+        """ Runs a GDB method (LoadTable, GeocodeTable,
+        JoinSpatialTableToLayer) in a worker process and returns what the
+        owner needs to merge with MergeTaskResult.
+        """
+        self._pending_stages = list()
+        self.new_layers = list()
+        self._tables = list()
+        getattr(self, method)(*args)
+        return {'stages': self._pending_stages,
+                'dataset_keys': self._dataset_keys,
+                'tables': self._tables,
+                'layers': [vars(lyr) for lyr in self.new_layers],
+                'geocode_stats': self.geocode_stats,
+                'dataset_paths': self._dataset_paths,
+                'scratch_stats': self.scratch_stats,
+                'generalized': self.generalized}
+
+    def MergeTaskResult(self, result):
+        """ Merges the result of RunTask into this project and returns the
+        task's new layers.
+        """
+        self._applyStages(result['stages'])
+        self._dataset_keys.update(result['dataset_keys'])
+        self._tables.extend(result['tables'])
+        self.geocode_stats.update(result['geocode_stats'])
+        self._dataset_paths.update(result['dataset_paths'])
+        self.scratch_stats.update(result['scratch_stats'])
+        self.generalized.update(result['generalized'])
+        return [layer.Layer(definition) for definition in result['layers']]
 
     def setPaths(self):
         self.workspace_path = os.path.join(self.base_path, 'Output')
@@ -52,14 +166,52 @@ class Project(object):
         ArcPy MapDocument object.
         """
         if self._mxd is None:
-            mxd = self._startNewMXDFile()
+            if self.incremental:
+                self._openManifest()
+            if self.checkpointing or self.resume:
+                self._openCheckpoint()
+            if self._isCurrent('mxd', self._mxdKey(), self._getMXDPath()):
+                print('\nProject MXD is current, reusing: %s' % (self._getMXDPath()))
+                mxd = arcpy.mapping.MapDocument(self._getMXDPath())
+                self.mxd_current = True
+            else:
+                mxd = self._startNewMXDFile()
             self._mxd = mxd
+            self._elements = export.layout_elements(mxd)
             self._InitProjectGDB()
         else:
             mxd = self._mxd
         return mxd
 
 
+    def OpenData(self):
+        """ Opens the manifest, checkpoint and project GDB without an MXD, for
+        runs that only load data.
+        """
+        if self.incremental:
+            self._openManifest()
+        if self.checkpointing or self.resume:
+            self._openCheckpoint()
+        self._InitProjectGDB()
+
+
+    def AddSharedData(self, table_paths, layers):
+        """ Adds tables and layers loaded by a BatchController's data stages. """
+        self.AddTableViews(table_paths)
+        self.new_layers.extend(layers)
+        print('\n%s shared Table(s) and %s shared Layer(s) added from: %s'
+              % (len(table_paths), len(layers), self.gdb_path))
+        self._saveMXD()
+
+
+    def AddTableViews(self, table_paths):
+        """ Adds table views for loaded tables to the MXD, unless it is current. """
+        if not self.mxd_current:
+            for path in table_paths:
+                self._addTable(path)
+        self._saveMXD()
+
+
     def AddLayers(self):
         """
 
@@ -86,20 +238,133 @@ class Project(object):
         i = 0
         for x in xrange(0, len(self.new_tables)):
             table = self.new_tables.pop()
-            self._TableToTable(table.path, table.name)
-            self._addTable(table.path)
-            self._tables.append(table)
+            self.LoadTable(table)
+            if not self.mxd_current and not self.data_only:
+                self._addTable(table.path)
             i += 1
         print ('\n%s new Table(s) added' % (i))
         geocoded = self._GeocodeTables()
         print ('\n%s new Layer(s) Geocoded.' % (geocoded))
         self._saveMXD()
 
-    def StyleLayers(self):
-        for layer in self._layers:
-            if layer.style:
-                style_layer = arcpy.mapping.Layer(os.path.join(self.style_path, layer.style))
-                self.ApplyStyle(layer.name, style_layer)
+    def LoadTable(self, table):
+        """ Loads a table to the project's GDB unless it is current.  Does not
+        touch the MXD.
+        """
+        unit = 'table:' + table.name
+        key = self._tableKey(table)
+        workspace = self.gdb_path
+        if self._tableScratch(table):
+            workspace = scratch.WORKSPACE
+            self._dataset_paths[table.name] = scratch.path(table.name)
+        if self._isCurrent(unit, key, self.DatasetPath(table.name)):
+            print('\nTable %s is current, skipping load.' % (table.name))
+        else:
+            if table.loader == 'stream':
+                loader.load_table(table.path, workspace, table.name, table.chunk_size,
+                                  table.schema, table.delimiter, table.sample_rows)
+            else:
+                self._TableToTable(table.path, table.name, workspace)
+            if workspace == scratch.WORKSPACE:
+                self._recordScratch(table.name, scratch.estimate_bytes(self.DatasetPath(table.name)))
+            self._completeStage(unit, key)
+        self._dataset_keys[table.name] = key
+        self._tables.append(table)
+
+    def DatasetPath(self, name):
+        """ Returns the path of a dataset loaded or built by the project,
+        in the scratch workspace or the project GDB.
+        """
+        try:
+            return self._dataset_paths[name]
+        except KeyError:
+            return os.path.join(self.gdb_path, name)
+
+    def PrintScratchStats(self):
+        if self.scratch_stats:
+            total = sum(self.scratch_stats.values())
+            print('\nScratch workspace:  %s intermediate datasets kept in memory, about %.1f MB '
+                  'of GDB writes avoided.' % (len(self.scratch_stats), total / 1048576.0))
+            for name, size in sorted(self.scratch_stats.items()):
+                print('  %10.1f KB  %s' % (size / 1024.0, name))
+
+    def _tableScratch(self, table):
+        """ Returns True when `table` loads to the scratch workspace.  Tables
+        read by other processes (task workers, sharded geocoding workers) stay
+        in the project GDB.
+        """
+        use_scratch = self.scratch if table.scratch is None else table.scratch
+        if not use_scratch:
+            return False
+        if not self.scratch_available or (table.geocode and table.geocode_shard_size
+                                          and table.geocode_workers > 1):
+            print('\nTable %s is read by worker processes, loading it to the project GDB '
+                  'instead of the scratch workspace.' % (table.name))
+            return False
+        return True
+
+    def _recordScratch(self, name, size):
+        self.scratch_stats[name] = max(size, 0)
+
+    def SplitTable(self, path, name, key_column, extension='.txt', delimiter='\t',
+                   max_open=64):
+        """ Splits the delimited file at `path` into one file per value of
+        `key_column` and returns a list of (key, table name, file path)
+        tuples, one for each split.
+        """
+        split_path = self._getSplitPath()
+        make_sure_path_exists(split_path)
+        print('\nSplitting %s by %s.' % (path, key_column))
+        splits = splitter.split_file(path, split_path, name, key_column, extension,
+                                     delimiter, max_open)
+        for key, table_name, rows in splits:
+            print('  %s:  %s rows' % (table_name, rows))
+        return [(key, table_name, os.path.join(split_path, table_name + extension))
+                for key, table_name, rows in splits]
+
+    def StyleLayers(self, batch=None):
+        """ Applies each layer's style.  Style layers (.lyr) are loaded once
+        per run and reused by every layer sharing the file.
+
+        With `batch` (defaults to style_batch), layers are grouped by style
+        and each group is updated in one pass using UpdateLayer.
+        """
+        if batch is None:
+            batch = self.style_batch
+
+        if batch:
+            groups = collections.OrderedDict()
+            for layer in self._layers:
+                if layer.style:
+                    groups.setdefault(layer.style, list()).append(layer.name)
+            dataframe = self._getDataFrame()
+            for style, layer_names in groups.items():
+                style_layer = self._getStyleLayer(style)
+                print('\nStyling %s layers using:  %s' % (len(layer_names), style))
+                for layer_name in layer_names:
+                    arcpy.mapping.UpdateLayer(dataframe, self._getLayer(layer_name),
+                                              style_layer, True)
+                self._markDirty()
+        else:
+            for layer in self._layers:
+                if layer.style:
+                    style_layer = self._getStyleLayer(layer.style)
+                    self.ApplyStyle(layer.name, style_layer)
+
+        print('\nStyle layers:  %(loads)s loaded, %(hits)s cache hits.' % self.style_stats)
+
+    def _getStyleLayer(self, style):
+        """ Returns the style layer for a style file in the project's style
+        path, cached by resolved path and modified time.
+        """
+        path = os.path.abspath(os.path.join(self.style_path, style))
+        key = (path, os.path.getmtime(path))
+        if key in self._style_cache:
+            self.style_stats['hits'] += 1
+        else:
+            self.style_stats['loads'] += 1
+            self._style_cache[key] = arcpy.mapping.Layer(path)
+        return self._style_cache[key]
 
        
     def JoinTableToLayer(self, table_name, table_name_new, table_path,
@@ -130,6 +395,15 @@ class Project(object):
 
         This module is likely more flexible than that, but that's what I
         have currently tested.
+
+        The optional "backend" key (defaults to spatial_join_backend) selects
+        SpatialJoin_analysis ('arcpy') or the indexed NumPy point in polygon
+        join ('numpy'), which only writes polygons containing points.
+
+        The optional "aggregate" key adds statistics per polygon (see
+        spatialjoin.aggregate_points_to_polygons), e.g.
+            {'group_by': 'TERM', 'stats': [('count', None), ('mean', 'AGE')]}
+        and always uses the NumPy backend.
         """
         #print('In JoinSpatialTableToLayer.  definition: {}'.format(definition))
         layer_name = definition['layer_name']
@@ -141,14 +415,49 @@ class Project(object):
         except KeyError:
             layer_style = False
 
+        try:
+            aggregate = definition['aggregate']
+        except KeyError:
+            aggregate = None
+
+        try:
+            use_scratch = definition['scratch']
+        except KeyError:
+            use_scratch = self.scratch
+
+        backend = self.JoinBackend(definition)
+
         out_name = layer_name + '__' + table_name
                                 
         out_feature_class = self.gdb_path + '\\' + out_name
-        join_features = self.gdb_path + '\\' + table_name
+        join_features = self.DatasetPath(table_name)
         
-        arcpy.SpatialJoin_analysis(target_features=layer_path,
-                                   join_features=join_features,
-                                   out_feature_class=out_feature_class)
+        unit = 'join:' + out_name
+        key = self._joinKey(dict(definition, backend=backend), layer_path, join_features)
+        if self._isCurrent(unit, key, out_feature_class):
+            print('\nSpatial join %s is current, skipping join.' % (out_name))
+        elif aggregate:
+            matched, total, fields = spatialjoin.aggregate_points_to_polygons(layer_path,
+                                                                              join_features,
+                                                                              out_feature_class,
+                                                                              aggregate)
+            print('\nSpatial join %s:  %s of %s polygons contain points.  Fields: %s'
+                  % (out_name, matched, total, ', '.join(fields)))
+            self._completeStage(unit, key)
+        elif backend == 'numpy':
+            matched, total = spatialjoin.join_points_to_polygons(layer_path, join_features,
+                                                                 out_feature_class)
+            print('\nSpatial join %s:  %s of %s polygons contain points.' % (out_name, matched, total))
+            self._completeStage(unit, key)
+        elif use_scratch:
+            self._scratchJoin(layer_path, join_features, out_feature_class)
+            self._completeStage(unit, key)
+        else:
+            arcpy.SpatialJoin_analysis(target_features=layer_path,
+                                       join_features=join_features,
+                                       out_feature_class=out_feature_class)
+            self._completeStage(unit, key)
+        self._dataset_keys[out_name] = key
 
         new_layer = layer.Layer({'path': out_feature_class,
                                  'name': out_name,
@@ -158,98 +467,536 @@ class Project(object):
 
         self.new_layers.append(new_layer)
 
+    def _scratchJoin(self, layer_path, join_features, out_feature_class):
+        """ Runs SpatialJoin_analysis in the scratch workspace and writes only
+        the polygons containing points (Join_Count > 0) to the project GDB.
+        """
+        out_path, out_name = os.path.split(out_feature_class)
+        scratch_path = scratch.path(out_name)
+        scratch.delete(scratch_path)
+        arcpy.SpatialJoin_analysis(target_features=layer_path,
+                                   join_features=join_features,
+                                   out_feature_class=scratch_path)
+        if arcpy.Exists(out_feature_class):
+            arcpy.Delete_management(out_feature_class)
+        arcpy.FeatureClassToFeatureClass_conversion(scratch_path, out_path, out_name, 'Join_Count > 0')
+        self._recordScratch(out_name, scratch.estimate_bytes(scratch_path)
+                            - scratch.estimate_bytes(out_feature_class))
+        scratch.delete(scratch_path)
+
+    def GeneralizeLayer(self, definition):
+        """ Writes generalized copies of a polygon or line layer to the
+        project GDB, one per tolerance, and reports the vertex reduction.
+        SaveOutputs draws the copy matching each output's scale.  Does not
+        touch the MXD.
+        """
+        lyr = layer.Layer(definition)
+        description = arcpy.Describe(lyr.path)
+        if description.shapeType not in ('Polygon', 'Polyline'):
+            print('\nLayer %s has %s features, only polygon and line layers are generalized.'
+                  % (lyr.name, description.shapeType))
+            return
+        if lyr.generalize is True:
+            extent = description.extent
+            tolerances = generalize.default_tolerances(extent.width, extent.height)
+        else:
+            tolerances = sorted(lyr.generalize)
+
+        levels = list()
+        for i, tolerance in enumerate(tolerances):
+            name = '%s__g%s' % (splitter.safe_name(lyr.name), i + 1)
+            path = os.path.join(self.gdb_path, name)
+            unit = 'generalize:' + name
+            key = self._generalizeKey(lyr.path, tolerance)
+            if self._isCurrent(unit, key, path):
+                print('\nGeneralized layer %s is current, skipping.' % (name))
+            else:
+                before, after = generalize.generalize_features(lyr.path, path, tolerance)
+                print('\nGeneralized %s at tolerance %g:  %s -> %s vertices (%.0f%% fewer).'
+                      % (lyr.name, tolerance, before, after,
+                         100.0 * (before - after) / before if before else 0.0))
+                self._completeStage(unit, key)
+            self._dataset_keys[name] = key
+            levels.append((tolerance, path))
+        self.generalized[lyr.name] = {'original': lyr.path, 'levels': levels,
+                                      'spatial_reference': description.spatialReference.exportToString()}
+
+    def JoinBackend(self, definition):
+        """ Returns the backend a spatial join definition uses, raising
+        ValueError for an unknown backend or statistic, or a sum or mean
+        without a field.
+        """
+        try:
+            aggregate = definition['aggregate']
+        except KeyError:
+            aggregate = None
+
+        try:
+            backend = definition['backend']
+        except KeyError:
+            if aggregate:
+                backend = 'numpy'
+            else:
+                backend = self.spatial_join_backend
+        layer_name = definition['layer_name']
+        if backend not in ('arcpy', 'numpy'):
+            raise ValueError('Unknown spatial join backend "%s" for %s.' % (backend, layer_name))
+        if aggregate and backend != 'numpy':
+            raise ValueError('Spatial join aggregates for %s require the "numpy" backend.' % (layer_name))
+        if aggregate:
+            for stat, field in aggregate.get('stats', list()):
+                if stat not in spatial.AGGREGATE_STATS:
+                    raise ValueError('Unknown aggregate statistic "%s" for %s.' % (stat, layer_name))
+                if stat != 'count' and not field:
+                    raise ValueError('Aggregate statistic "%s" for %s requires a field.' % (stat, layer_name))
+        return backend
+
     def AddCalculatedField(self, target_table_name, new_field_name, data_type, alias, calc):
-        table_path = os.path.join(self.gdb_path, target_table_name)
+        table_path = self.DatasetPath(target_table_name)
         print ('\nAdding calculated field "%s" to table: %s' % (new_field_name, table_path))        
         arcpy.AddField_management(table_path, new_field_name, data_type, '', '', '', alias)
         arcpy.CalculateField_management(table_path, new_field_name, calc)
 
+    def AddCalculatedFields(self, target_table_name, fields, null_values=None):
+        """ Bulk version of AddCalculatedField.  Reads the input columns once,
+        computes each field with a vectorized callable and writes all fields
+        back in one pass.  See fieldcalc.calculate_fields for the field
+        definitions, e.g.
+            {'name': 'AGE_2', 'type': 'DOUBLE', 'inputs': ['AGE'],
+             'calc': lambda columns: columns['AGE'] * 2}
+        """
+        table_path = self.DatasetPath(target_table_name)
+        print('\nAdding %s calculated fields to table: %s' % (len(fields), table_path))
+        timings = fieldcalc.calculate_fields(table_path, fields, null_values)
+        for step, seconds in timings:
+            print('  %8.2fs  %s' % (seconds, step))
+
 
     def SortLayers(self, move_layer_name, ref_layer_name, insert_position):
-        """ Sorts layers. """
+        """ Sorts layers.  Moving a layer keeps the same layer objects, so the
+        layer index stays valid.
+        """
         dataframe = self._getDataFrame()
-        mxd = self.getMXDFile()
 
-        move_layer = arcpy.mapping.ListLayers(mxd, move_layer_name, dataframe)[0]
-        ref_layer = arcpy.mapping.ListLayers(mxd, ref_layer_name, dataframe)[0]
+        move_layer = self._getLayer(move_layer_name)
+        ref_layer = self._getLayer(ref_layer_name)
 
         arcpy.mapping.MoveLayer(dataframe, ref_layer, move_layer, insert_position)
+        self._markDirty()
         print ('\nMoved layer "%s" below layer "%s".' % (move_layer, ref_layer))
 
 
+    def RemoveLayer(self, layer_name):
+        """ Removes a layer from the MXD and the layer index. """
+        target_layer = self._getLayer(layer_name)
+        arcpy.mapping.RemoveLayer(self._getDataFrame(), target_layer)
+        del self._layer_index[layer_name]
+        self._markDirty()
+        print('\nRemoved layer "%s".' % (layer_name))
+
+
     def ApplyStyle(self, target_layer_name, style_layer_path):
         print('\nStyling layer %s.  Using layer as reference:  %s' % (target_layer_name, style_layer_path))
-        dataframe = self._getDataFrame()
-        mxd = self.getMXDFile()
-        target_layer = arcpy.mapping.ListLayers(mxd, target_layer_name, dataframe)[0]
+        target_layer = self._getLayer(target_layer_name)
         arcpy.ApplySymbologyFromLayer_management(target_layer, style_layer_path)
+        self._markDirty()
 
     def LabelLayer(self, layer_name, label_expression):
         print('\nAddling labels to %s using expression %s' % (layer_name, label_expression))
-        dataframe = self._getDataFrame()
-        mxd = self.getMXDFile()
-        target_layer = arcpy.mapping.ListLayers(mxd, layer_name, dataframe)[0]
+        target_layer = self._getLayer(layer_name)
         target_layer.labelClasses[0].expression = label_expression
         target_layer.showLabels = True
+        self._markDirty()
         arcpy.RefreshActiveView()
 
     def LegendStart(self):
         """ LegendStart enables legend auto add, so layers added after calling this
         method and before calling the LegendStop method will be included in the legend.
         """
-        legend = arcpy.mapping.ListLayoutElements(self.getMXDFile(), "LEGEND_ELEMENT", "Legend")[0]
+        legend = self._getLegend()
         legend.autoAdd = True
+        self._markDirty()
     
 
     def LegendStop(self):
-        legend = arcpy.mapping.ListLayoutElements(self.getMXDFile(), "LEGEND_ELEMENT", "Legend")[0]
+        legend = self._getLegend()
         legend.autoAdd = False
+        self._markDirty()
 
     def LegendPosition(self):
-        legend = arcpy.mapping.ListLayoutElements(self.getMXDFile(), "LEGEND_ELEMENT", "Legend")[0]
+        legend = self._getLegend()
         legend.elementPositionX = self.legend_x
         legend.elementPositionY = self.legend_y
+        self._markDirty()
 
     def LegendStyle(self, name = 'Horizontal with Heading and Labels'):
-        legend = arcpy.mapping.ListLayoutElements(self.getMXDFile(),
-                                                  "LEGEND_ELEMENT")[0]
+        legend = self._getLegend()
         styleItem = arcpy.mapping.ListStyleItems("ESRI.style",
                                                  "Legend Items",
                                                  name)[0]
         for lyr in legend.listLegendItemLayers():
              legend.updateItem(lyr, styleItem)
+        self._markDirty()
 
  
 
-    def SaveOutputs(self):
-        mxd = self.getMXDFile()
+    def TileOutputs(self, definitions):
+        """ Returns the output definitions for each tile definition (see the
+        tiles module).  Unless a definition sets skip_empty to False, tiles
+        whose extent has no feature in the definition's layers are dropped.
+        """
+        outputs = list()
+        indexes = dict() # Tuple of layer names (None for visible layers) -> GridIndex
+        for definition in definitions:
+            if 'path' in definition:
+                tiled = tiles.feature_outputs(definition, self._featureExtents(definition))
+            else:
+                tiled = tiles.grid_outputs(definition)
+
+            try:
+                skip_empty = definition['skip_empty']
+            except KeyError:
+                skip_empty = True
+            if skip_empty:
+                try:
+                    layer_names = tuple(definition['layers'])
+                except KeyError:
+                    layer_names = None
+                if layer_names not in indexes:
+                    indexes[layer_names] = spatial.GridIndex(self.LayerBoundingBoxes(layer_names))
+                kept = tiles.drop_empty(tiled, indexes[layer_names])
+                print('\n%s:  %s tiles, %s without data skipped.'
+                      % (definition['name'], len(tiled), len(tiled) - len(kept)))
+                tiled = kept
+            else:
+                print('\n%s:  %s tiles.' % (definition['name'], len(tiled)))
+            outputs.extend(tiled)
+        return outputs
+
+    def LayerBoundingBoxes(self, layer_names=None):
+        """ Returns a list of (xmin, ymin, xmax, ymax) feature bounding boxes,
+        in the data frame's coordinate system, for the named feature layers
+        or every visible feature layer in the MXD.  Definition queries apply.
+        """
         dataframe = self._getDataFrame()
+        bboxes = list()
+        for lyr in arcpy.mapping.ListLayers(self.getMXDFile(), '*', dataframe):
+            if not lyr.isFeatureLayer:
+                continue
+            if layer_names is None and not lyr.visible:
+                continue
+            if layer_names is not None and lyr.name not in layer_names:
+                continue
+            bboxes.extend(self._layerFeatures(lyr)[0])
+        return bboxes
+
+    def LayerIndexes(self):
+        """ Returns a dictionary of layer name -> GridIndex of feature bounding
+        boxes for every visible feature layer in the MXD.  Built once per run.
+        """
+        if self._layer_indexes is None:
+            dataframe = self._getDataFrame()
+            bboxes = collections.OrderedDict()
+            for lyr in arcpy.mapping.ListLayers(self.getMXDFile(), '*', dataframe):
+                if lyr.isFeatureLayer and lyr.visible:
+                    bboxes.setdefault(lyr.name, list()).extend(self._layerFeatures(lyr)[0])
+            self._layer_indexes = collections.OrderedDict(
+                [(name, spatial.GridIndex(boxes)) for name, boxes in bboxes.items()])
+        return self._layer_indexes
+
+    def _layerFeatures(self, lyr):
+        """ Returns the bounding boxes of a feature layer's features, in the
+        data frame's coordinate system with its definition query applied, and
+        with render_cache their content digests (geometry and attributes,
+        otherwise None).
+
+        Each layer is read once per run, tiling, the render cache and culling
+        share the result.
+        """
+        where = lyr.definitionQuery if lyr.supports('DEFINITIONQUERY') else None
+        key = (lyr.name, lyr.dataSource, where)
+        if key not in self._layer_features:
+            fields = list()
+            digests = None
+            if self.render_cache:
+                fields = [field.name for field in arcpy.ListFields(lyr.dataSource)
+                          if field.type not in ('Geometry', 'OID')]
+                digests = list()
+            bboxes = list()
+            with arcpy.da.SearchCursor(lyr.dataSource, ['SHAPE@'] + fields, where,
+                                       self._getDataFrame().spatialReference) as cursor:
+                for row in cursor:
+                    if row[0] is None:
+                        continue
+                    extent = row[0].extent
+                    bboxes.append((extent.XMin, extent.YMin, extent.XMax, extent.YMax))
+                    if digests is not None:
+                        digests.append(manifest.definition_hash(row[0].WKT, row[1:]))
+            self._layer_features[key] = (bboxes, digests)
+        return self._layer_features[key]
+
+    def _hiddenLayers(self, output):
+        """ Returns the names of the layers not drawn for `output`.
+
+        Outputs can set "hide_layers" (always hidden), "cull_layers"
+        (defaults to cull_layers) to hide layers with no feature overlapping
+        the extent drawn in the data frame, and "keep_layers" (never culled).
+        """
+        try:
+            hidden = set(output['hide_layers'])
+        except KeyError:
+            hidden = set()
+        try:
+            cull = output['cull_layers']
+        except KeyError:
+            cull = self.cull_layers
+        try:
+            keep = output['keep_layers']
+        except KeyError:
+            keep = list()
+        if cull:
+            extent = export.drawn_extent(self._getDataFrame(), output)
+            for name, index in self.LayerIndexes().items():
+                if name not in keep and not index.intersects(*extent):
+                    hidden.add(name)
+        return sorted(hidden)
+
+    def _removeHidden(self, output):
+        """ Returns True when hidden layers are removed for `output` so the
+        legend drops them ("cull_legend", defaults to cull_legend).
+        """
+        try:
+            return output['cull_legend']
+        except KeyError:
+            return self.cull_legend
+
+    def _reloadMXD(self):
+        """ Opens the saved project MXD again, discarding changes made for
+        one output.  Returns the MXD and its data frame.
+        """
+        self._mxd = arcpy.mapping.MapDocument(self._getMXDPath())
+        self._dataframe = None
+        self._layer_index = None
+        self._elements = export.layout_elements(self._mxd)
+        return self._mxd, self._getDataFrame()
+
+    def _featureExtents(self, definition):
+        """ Returns (name, bounds) for each feature of a feature tile
+        definition, in the data frame's coordinate system.
+        """
+        try:
+            name_field = definition['name_field']
+        except KeyError:
+            name_field = 'OID@'
+        try:
+            where = definition['where']
+        except KeyError:
+            where = None
+        features = list()
+        with arcpy.da.SearchCursor(definition['path'], ['SHAPE@', name_field], where,
+                                   self._getDataFrame().spatialReference) as cursor:
+            for row in cursor:
+                if row[0] is not None:
+                    extent = row[0].extent
+                    features.append(('%s' % (row[1]),
+                                     (extent.XMin, extent.YMin, extent.XMax, extent.YMax)))
+        return features
+
+    def SaveOutputs(self):
+        """ Exports each of the project's outputs to PDF.
+
+        When `output_workers` is greater than 1 the outputs are exported by a
+        pool of worker processes, each using its own copy of the saved MXD.
+        Output names and the order of `output_timings` are the same in
+        either mode.
+
+        With `render_cache` set, outputs whose render fingerprint matches the
+        one recorded when their PDF was exported are reused (see _renderKeys).
+        """
+        self.getMXDFile()
         output_count = len(self.outputs)
         print ('\nSaving Output PDFs.  %s outputs found.' % (output_count))
         print ('Saving to project workspace:  %s' % (self.workspace_path))
 
-        self._SetFooterText('(c) OpenStreet Map Contributers & U.S. Census Bureau')
+        footer_text = '(c) OpenStreet Map Contributers & U.S. Census Bureau'
+        self._SetFooterText(footer_text)
+        if self.render_cache:
+            self._openRenderManifest()
+            self._render_keys = self._renderKeys(self.outputs, footer_text)
+
+        jobs = list()
+        reused = list()
+        culled = 0
+        for index, output in enumerate(self.outputs):
+            output_filename = export.output_filename(output, self.output_prefix)
+            output_path = os.path.join(self.workspace_path, output_filename)
+            if self._isCurrent('output:' + output_filename, self._outputKey(output),
+                               output_path, checkpoint_only=True):
+                print('\nOutput %s was saved before the run stopped, skipping.' % (output_filename))
+                continue
+            if self._isRendered(output_filename, output_path):
+                reused.append(output_filename)
+                continue
+            hidden = self._hiddenLayers(output)
+            if hidden:
+                print('\n%s:  not drawing %s' % (output['name'], ', '.join(hidden)))
+                culled += len(hidden)
+            jobs.append((index, output, output_path, hidden, bool(hidden) and self._removeHidden(output)))
+
+        workers = min(self.output_workers, len(jobs))
+        if workers > 1:
+            results = self._exportParallel(jobs, workers)
+        else:
+            results = self._exportSerial(jobs)
 
-        for output in self.outputs:
-            if self.output_prefix:
-                output_name = self.output_prefix + ' - ' + output['name']
-            else:
-                output_name = output['name']
+        self.output_timings = [(filename, seconds) for index, filename, seconds in sorted(results)]
+        self._saveMXD()
+        self._printOutputTimings()
+        if culled:
+            print('\nLayer culling:  %s layer draws skipped across %s outputs.' % (culled, len(jobs)))
+        if self.render_cache:
+            print('\nRender cache:  %s outputs rendered, %s reused.' % (len(results), len(reused)))
+            for output_filename in reused:
+                print('  Reused:  %s' % (output_filename))
 
-            output_filename =  output_name + '.pdf'
-            output_path =  os.path.join(self.workspace_path, output_filename)
 
-            extent = dataframe.extent
-            extent.XMin = output['xmin']
-            extent.YMin = output['ymin']
-            extent.XMax = output['xmax']
-            extent.YMax = output['ymax']
-            dataframe.extent = extent
+    def _openRenderManifest(self):
+        make_sure_path_exists(self.workspace_path)
+        path = os.path.join(self.workspace_path, self.name + '_render.json')
+        print('\nRender cache: %s' % (path))
+        self.render_manifest = manifest.Manifest(path)
 
-            self._SetHeaderText(output['name'])
-            arcpy.mapping.ExportToPDF(mxd, output_path)
-            print('Saved:  %s' % (output_filename))
-        self._saveMXD()
+    def _isRendered(self, output_filename, output_path):
+        """ Returns True when the output's PDF exists and was exported from
+        the same render fingerprint.
+        """
+        if self.render_manifest is None or self.render_refresh:
+            return False
+        return (self.render_manifest.matches('output:' + output_filename,
+                                             self._render_keys.get(output_filename))
+                and os.path.exists(output_path))
+
+    def _renderKeys(self, outputs, footer_text):
+        """ Returns a dictionary of output filename -> render fingerprint.
+
+        The fingerprint covers the output's extent and header, the footer, the
+        layers hidden or removed for it, the template, styles and definitions
+        the MXD is built from, and for each visible layer its data source, definition query and a digest of the
+        features whose bounding box overlaps the extent drawn in the data
+        frame.  Features are looked up per output with a GridIndex.
+        """
+        dataframe = self._getDataFrame()
+        spatial_reference = dataframe.spatialReference
+        mxd_key = manifest.definition_hash(self.render_manifest.fingerprint(self.template_mxd),
+                                           self.render_manifest.fingerprint(self.style_path),
+                                           self.legend_x, self.legend_y, self.mxd_definition,
+                                           spatial_reference.exportToString())
+        layers = list()
+        for lyr in arcpy.mapping.ListLayers(self.getMXDFile(), '*', dataframe):
+            if not lyr.visible or lyr.isGroupLayer:
+                continue
+            parts = [lyr.name,
+                     lyr.dataSource if lyr.supports('DATASOURCE') else None,
+                     lyr.definitionQuery if lyr.supports('DEFINITIONQUERY') else None]
+            if lyr.isFeatureLayer:
+                bboxes, digests = self._layerFeatures(lyr)
+                layers.append((parts, spatial.GridIndex(bboxes), digests))
+            else:
+                layers.append((parts, None, None))
+
+        keys = dict()
+        for output in outputs:
+            extent = export.drawn_extent(dataframe, output)
+            layer_keys = list()
+            for parts, index, digests in layers:
+                if index is None:
+                    layer_keys.append(parts)
+                    continue
+                found = index.query(*extent)
+                layer_keys.append((parts, manifest.definition_hash(sorted([digests[i] for i in found]))))
+            hidden = self._hiddenLayers(output)
+            remove = bool(hidden) and self._removeHidden(output)
+            output_filename = export.output_filename(output, self.output_prefix)
+            keys[output_filename] = manifest.definition_hash(output, self.header_prefix, footer_text,
+                                                             mxd_key, layer_keys, hidden, remove)
+        return keys
+
+
+    def _exportSerial(self, jobs):
+        mxd = self.getMXDFile()
+        dataframe = self._getDataFrame()
+        results = list()
+        current = dict() # Generalized layer name -> level path in use
+        if [job for job in jobs if job[4]]:
+            self.Commit() # Layers removed for an output are restored by opening the saved MXD.
+        self._markDirty()
+        try:
+            for index, output, output_path, hidden, remove_hidden in jobs:
+                print ('\nUpdating header for %s.' % (output['name']))
+                seconds = export.export_output(mxd, dataframe, self._getElements(),
+                                               output, output_path, self.header_prefix,
+                                               self.generalized, current, hidden, remove_hidden)
+                if remove_hidden:
+                    mxd, dataframe = self._reloadMXD()
+                    current = dict()
+                    self._markDirty()
+                output_filename = os.path.basename(output_path)
+                print('Saved:  %s' % (output_filename))
+                end = time.time()
+                trace.record(output_filename, 'output', end - seconds, end)
+                self._completeOutput(output, output_filename)
+                results.append((index, output_filename, seconds))
+        finally:
+            generalize.restore(mxd, dataframe, self.generalized, current)
+        return results
+
+
+    def _exportParallel(self, jobs, workers):
+        """ Exports outputs using a pool of worker processes.
+
+        The MXD is committed first so every worker opens the same document,
+        each worker opens it once and then takes outputs one at a time.
+        """
+        self.Commit()
+        outputs = dict([(job[0], job[1]) for job in jobs])
+        print('\nExporting %s outputs using %s worker processes.' % (len(jobs), workers))
+        pool = multiprocessing.Pool(processes=workers,
+                                    initializer=export.init_worker,
+                                    initargs=(self.getMXDFile().filePath, self.header_prefix,
+                                              self.generalized))
+        results = list()
+        try:
+            for index, output_filename, seconds in pool.imap_unordered(export.export_worker, jobs):
+                print('Saved:  %s' % (output_filename))
+                end = time.time()
+                trace.record(output_filename, 'output', end - seconds, end, worker=True)
+                self._completeOutput(outputs[index], output_filename)
+                results.append((index, output_filename, seconds))
+        finally:
+            pool.close()
+            pool.join()
+        return results
+
+
+    def DatasetRowCounts(self):
+        """ Returns a dictionary of dataset name -> row count for the GDB
+        datasets built by this run.
+        """
+        counts = dict()
+        for name in sorted(self._dataset_keys):
+            path = self.DatasetPath(name)
+            if arcpy.Exists(path):
+                counts[name] = int(arcpy.GetCount_management(path).getOutput(0))
+        return counts
+
+
+    def _printOutputTimings(self):
+        total = 0.0
+        print('\nOutput export timings:')
+        for output_filename, seconds in self.output_timings:
+            total += seconds
+            print('  %8.2fs  %s' % (seconds, output_filename))
+        print('  %8.2fs  Total (%s outputs)' % (total, len(self.output_timings)))
 
 
     def _GeocodeTables(self):
@@ -257,64 +1004,162 @@ class Project(object):
         for table in self._tables:
             print(table)
             if table.geocode:
-                table_path = os.path.join(self.gdb_path, table.name)
-                geocoded_name = table.geocoded_layer_name
-                self._geocode(table_path, geocoded_name)
-                geocoded_layer_path = os.path.join(self.gdb_path, geocoded_name)
-                geocoded_layer = layer.Layer({'path': geocoded_layer_path,
-                                              'name': geocoded_name,
-                                              'style': table.geocode_layer_style,
-                                              'visible': table.visible})
-
-                self.new_layers.append(geocoded_layer)
+                self.GeocodeTable(table)
                 i += 1
+        self.PrintGeocodeCacheStats()
         return i
 
-    def _geocode(self, table, out_name):
+    def PrintGeocodeCacheStats(self):
+        if self._geocode_cache is not None:
+            stats = self._geocode_cache.stats()
+            print('\nGeocode cache:  %(hits)s hits, %(misses)s misses (%(hit_rate).1f%% hit rate), '
+                  '%(stored)s stored, %(evicted)s evicted.' % stats)
+
+    def GeocodeTable(self, table):
+        """ Geocodes a loaded table unless its geocoded layer is current and
+        adds the geocoded layer to new_layers.  Does not touch the MXD.
+        """
+        table_path = self.DatasetPath(table.name)
+        geocoded_name = table.geocoded_layer_name
+        geocoded_layer_path = os.path.join(self.gdb_path, geocoded_name)
+        unit = 'geocode:' + geocoded_name
+        key = self._geocodeKey(table)
+        if self._isCurrent(unit, key, geocoded_layer_path):
+            print('\nGeocoded layer %s is current, skipping geocode.' % (geocoded_name))
+        else:
+            # Sharded geocoding workers read the pending addresses, so they stay on disk.
+            use_scratch = self.scratch if table.scratch is None else table.scratch
+            self._geocode(table_path, geocoded_name, table.geocode_dedupe,
+                          table.geocode_shard_size, table.geocode_workers,
+                          use_scratch and table.geocode_workers <= 1)
+            self._completeStage(unit, key)
+        self._dataset_keys[geocoded_name] = key
+        geocoded_layer = layer.Layer({'path': geocoded_layer_path,
+                                      'name': geocoded_name,
+                                      'style': table.geocode_layer_style,
+                                      'visible': table.visible})
+
+        self.new_layers.append(geocoded_layer)
+
+    def _geocode(self, table, out_name, dedupe=False, shard_size=None, workers=1,
+                 use_scratch=False):
+        if dedupe or self.geocode_cache:
+            self._geocodeUnique(table, out_name, shard_size, workers, use_scratch)
+            return
         address_locator = self.address_locator
-        address_fields = "Street street_1; City city; State state; Zip zip"
+        address_fields = geocode.address_field_map()
         out_feature_class = os.path.join(self.gdb_path, out_name)
         msg = '\nGeocoding table:  %s\nOutput name: %s\nOutput Path: %s\nLocator: %s\nAddress Fields: %s'
         msg = msg % (table, out_name, out_feature_class, address_locator, address_fields)
         print(msg)
-        arcpy.GeocodeAddresses_geocoding(table,
-                                         address_locator,
-                                         address_fields,
-                                         out_feature_class)
+        geocode.geocode(table, address_locator, address_fields, out_feature_class,
+                        shard_size, workers, self._getScratchPath())
+
+    def _geocodeUnique(self, table, out_name, shard_size=None, workers=1, use_scratch=False):
+        """ Geocodes each unique normalized address in a table once, then joins
+        the points back to every row by address key.
+
+        When the geocode cache is enabled only addresses missing from the
+        cache are sent to the locator.  With `use_scratch` the pending
+        address table and raw locator output are kept in the scratch
+        workspace.
+        """
+        out_feature_class = os.path.join(self.gdb_path, out_name)
+        msg = '\nGeocoding unique addresses in table:  %s\nOutput Path: %s\nLocator: %s'
+        print(msg % (table, out_feature_class, self.address_locator))
+
+        row_count, addresses = geocode.unique_addresses(table)
+        if addresses:
+            ratio = float(row_count) / len(addresses)
+        else:
+            ratio = 1.0
+        print('Address dedup:  %s rows -> %s unique addresses (%.2fx fewer locator calls).'
+              % (row_count, len(addresses), ratio))
+
+        if self.geocode_cache:
+            cache = self._getGeocodeCache()
+            locations = cache.lookup(addresses)
+            spatial_reference = cache.spatial_reference()
+        else:
+            locations = dict()
+            spatial_reference = None
+
+        pending = sorted(addresses.difference(locations))
+        print('%s addresses cached, %s sent to locator.' % (len(locations), len(pending)))
+        self.geocode_stats[out_name] = {'rows': row_count,
+                                        'addresses': len(addresses),
+                                        'cached': len(locations),
+                                        'geocoded': len(pending)}
+
+        if pending:
+            workspace = scratch.WORKSPACE if use_scratch else self.gdb_path
+            results, spatial_reference = geocode.geocode_addresses(pending,
+                                                                   workspace,
+                                                                   out_name,
+                                                                   self.address_locator,
+                                                                   shard_size,
+                                                                   workers,
+                                                                   self._getScratchPath())
+            if self.geocode_cache:
+                cache.store(results, spatial_reference)
+            locations.update(results)
+
+        geocode.write_geocoded(table, out_feature_class, locations, spatial_reference)
+
+    def _getScratchPath(self):
+        """ Folder for scratch GDBs used by worker processes. """
+        return os.path.join(self.workspace_path, 'Scratch')
+
+    def _getSplitPath(self):
+        """ Folder for files written by SplitTable. """
+        return os.path.join(self.workspace_path, 'Split')
+
+    def _getGeocodeCache(self):
+        """ Opens the project's geocode cache, evicting old results. """
+        if self._geocode_cache is None:
+            path = self.geocode_cache_path
+            if path is None:
+                make_sure_path_exists(self.workspace_path)
+                path = os.path.join(self.workspace_path, self.name + '_geocode_cache.sqlite')
+            self._geocode_cache = geocache.GeocodeCache(path, self.address_locator,
+                                                        max_age_days=self.geocode_cache_max_age_days)
+        return self._geocode_cache
                                          
 
  
     def _SetHeaderText(self, line2_text):
         print ('\nUpdating header for %s.' % (line2_text))
-        for txt in arcpy.mapping.ListLayoutElements(self.getMXDFile(), "TEXT_ELEMENT"):
-            if txt.name == 'txtHeader':
-                txt.text = '<FNT size="18"><BOL>Front Range Community College</BOL></FNT>'
-                txt.text += '\r\n<FNT size="14"><BOL>%s</BOL></FNT>' % (self.header_prefix)
-                txt.text += '\r\n<FNT size="14">%s</FNT>' % (line2_text)
+        export.set_header_text(self._getElements(), self.header_prefix, line2_text)
+        self._markDirty()
     
     def _SetFooterText(self, copyright_text):
         print ('\nUpdating footer text fields.')
-        for txt in arcpy.mapping.ListLayoutElements(self.getMXDFile(), "TEXT_ELEMENT"):
-            if txt.name == 'txtLowerLeft':
-                txt.text = copyright_text
-            elif txt.name == 'txtLowerRight':
-                txt.text = 'Generated:  <dyn format="short" type="date">'
+        export.set_footer_text(self._getElements(), copyright_text)
+        self._markDirty()
 
     
     def _InitProjectGDB(self):
         """ Sets up the GDB for the project to use for storing data in. """
+        if self.shared_gdb_path is not None:
+            self.gdb_path = self.shared_gdb_path
+            print('\nUsing shared GDB at: %s' % (self.gdb_path))
+            return
         name = self.name + '.gdb'
         self.gdb_path = os.path.join(self.workspace_path, name)
-        print('\nCreating project GDB at: %s' % (self.gdb_path))
         if arcpy.Exists(self.gdb_path):
+            if self.incremental or self.resume:
+                print('\nReusing existing project GDB at: %s' % (self.gdb_path))
+                return
             arcpy.Delete_management(self.gdb_path)
+        print('\nCreating project GDB at: %s' % (self.gdb_path))
         arcpy.CreateFileGDB_management(self.workspace_path, name)        
 
 
-    def _TableToTable(self, path, table_name):
-        """ Loads data table to the project's GDB for use in a project."""
+    def _TableToTable(self, path, table_name, out_path=None):
+        """ Loads data table to the project's GDB (or `out_path`) for use in a project."""
         in_rows = path
-        out_path = self.gdb_path
+        if out_path is None:
+            out_path = self.gdb_path
         out_name = table_name
         
         if arcpy.Exists(out_path + '\\' + out_name):
@@ -332,6 +1177,7 @@ class Project(object):
         table = arcpy.mapping.TableView(path)
         print('\nLoading table:  %s' % (table.name))
         arcpy.mapping.AddTableView(dataframe, table)
+        self._markDirty()
 
 
     def _addLayer(self, path, name, definition_query=''):
@@ -344,6 +1190,9 @@ class Project(object):
         layer = arcpy.mapping.Layer(path)
         layer.definitionQuery = definition_query
         arcpy.mapping.AddLayer(dataframe, layer)
+        # AddLayer inserts a copy of the layer, the index is rebuilt on the next lookup.
+        self._layer_index = None
+        self._markDirty()
         
 
     def _startNewMXDFile(self):
@@ -352,24 +1201,228 @@ class Project(object):
         Requires an ArcPy MapDocument object.
         """
         print('\nUsing initial mxd Template: %s' % ( self.template_mxd))
-        path = os.path.join(self.workspace_path, self.name + '.mxd')
+        path = self._getMXDPath()
 
         make_sure_path_exists(self.workspace_path)
         
-        mxd = arcpy.mapping.MapDocument(self.template_mxd)
+        if self.template_cache is not None:
+            mxd = self.template_cache.get(self.template_mxd)
+        else:
+            mxd = arcpy.mapping.MapDocument(self.template_mxd)
         mxd.title = self.name
         mxd.author = self.author
         print('\nSaving to Path:  %s' % (path))
         mxd.saveACopy(path)
         return arcpy.mapping.MapDocument(path)
 
+    def _getMXDPath(self):
+        return os.path.join(self.workspace_path, self.name + '.mxd')
+
     def _getDataFrame(self):
         """ Uses MXD file object to return data frame."""
-        mxd = self.getMXDFile()
-        dataframe = arcpy.mapping.ListDataFrames(mxd,"*")[0]
-        return dataframe
+        if self._dataframe is None:
+            mxd = self.getMXDFile()
+            self._dataframe = arcpy.mapping.ListDataFrames(mxd,"*")[0]
+        return self._dataframe
+
+    def _getElements(self):
+        """ Returns the layout element registry (type -> elements). """
+        self.getMXDFile()
+        return self._elements
+
+    def _getLegend(self):
+        """ Returns the legend element named "Legend", or the first legend
+        element.
+        """
+        elements = self._getElements()
+        legends = (export.find_elements(elements, 'LEGEND_ELEMENT', 'Legend')
+                   or export.find_elements(elements, 'LEGEND_ELEMENT'))
+        if not legends:
+            raise KeyError('No legend element found in project MXD.')
+        return legends[0]
+
+    def _getLayer(self, name):
+        """ Returns the layer named `name` from the MXD's table of contents.
+
+        Uses an index built with a single ListLayers call, rebuilt only after
+        layers are added.  Raises KeyError when no layer has the name and
+        ValueError when more than one does.
+        """
+        if self._layer_index is None:
+            self._indexLayers()
+        try:
+            layers = self._layer_index[name]
+        except KeyError:
+            raise KeyError('Layer "%s" not found in project MXD.' % (name))
+        if len(layers) > 1:
+            raise ValueError('Layer name "%s" is used by %s layers in project MXD.' % (name, len(layers)))
+        return layers[0]
+
+    def _indexLayers(self):
+        index = dict()
+        for lyr in arcpy.mapping.ListLayers(self.getMXDFile(), '*', self._getDataFrame()):
+            index.setdefault(lyr.name, list()).append(lyr)
+        self._layer_index = index
 
     def _saveMXD(self):
-        mxd = self.getMXDFile()
-        mxd.save()
+        """ Save point at the end of a step.  The MXD is only written here
+        when save_every_step is set, otherwise changes wait for Commit().
+        """
+        if self.save_every_step:
+            self.Commit()
+
+    def _markDirty(self):
+        self._dirty = True
+
+    def Commit(self):
+        """ Writes the MXD to disk if it has changes that are not saved. """
+        if self._dirty:
+            print('\nSaving project MXD.')
+            self.getMXDFile().save()
+            self._dirty = False
+
+    def CompleteMXD(self):
+        """ Commits the MXD once layers, sort, legend and style are applied and
+        records it in the manifest so incremental runs can reuse it.
+        """
+        self.Commit()
+        self._completeStage('mxd', self._mxdKey())
+
+    def CompleteRun(self):
+        """ Marks the checkpoint complete, a later resume starts a new run.
+        Scratch datasets are deleted to free their memory.
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.markComplete()
+        for path in self._dataset_paths.values():
+            if scratch.is_scratch(path):
+                scratch.delete(path)
+
+    def _openManifest(self):
+        make_sure_path_exists(self.workspace_path)
+        path = os.path.join(self.workspace_path, self.name + '_manifest.json')
+        print('\nIncremental build using manifest: %s' % (path))
+        self.manifest = manifest.Manifest(path)
+
+    def _openCheckpoint(self):
+        """ Opens the run checkpoint.  Unless resuming a run that did not
+        complete, the checkpoint is reset for a new run.
+        """
+        make_sure_path_exists(self.workspace_path)
+        path = os.path.join(self.workspace_path, self.name + '_checkpoint.json')
+        self.checkpoint = manifest.Checkpoint(path)
+        if self.resume and self.checkpoint.canResume():
+            print('\nResuming run, %s units already complete.  Checkpoint: %s'
+                  % (len(self.checkpoint.stages), path))
+        else:
+            if self.resume:
+                print('\nNo incomplete run to resume, starting a new run.')
+                self.resume = False
+            self.checkpoint.reset()
+
+    def _stageLogs(self, checkpoint_only=False):
+        logs = [self.checkpoint]
+        if not checkpoint_only:
+            logs.append(self.manifest)
+        return [log for log in logs if log is not None]
+
+    def _isCurrent(self, unit, key, artifact, checkpoint_only=False):
+        """ Returns True when the manifest, or the checkpoint of a resumed run,
+        has the same key for `unit` and the unit's artifact exists.
+        Otherwise the unit is removed from both, since it is about to be
+        rebuilt.
+        """
+        logs = self._stageLogs(checkpoint_only)
+        if not self.resume and self.checkpoint in logs:
+            logs.remove(self.checkpoint)
+        for log in logs:
+            if log.matches(unit, key) and self._artifactExists(artifact):
+                return True
+        if self._pending_stages is not None:
+            self._pending_stages.append((unit, None, False))
+            return False
+        for log in self._stageLogs():
+            log.forget(unit)
+        return False
+
+    def _completeStage(self, unit, key, checkpoint_only=False):
+        if self._pending_stages is not None:
+            self._pending_stages.append((unit, key, checkpoint_only))
+            return
+        for log in self._stageLogs(checkpoint_only):
+            log.record(unit, key)
+
+    def _applyStages(self, stages):
+        """ Records (or forgets, when the key is None) stages completed by a
+        worker process.
+        """
+        for unit, key, checkpoint_only in stages:
+            if key is None:
+                for log in self._stageLogs():
+                    log.forget(unit)
+            else:
+                self._completeStage(unit, key, checkpoint_only)
+
+    def _completeOutput(self, output, output_filename):
+        self._completeStage('output:' + output_filename, self._outputKey(output),
+                            checkpoint_only=True)
+        if self.render_manifest is not None and output_filename in self._render_keys:
+            self.render_manifest.record('output:' + output_filename, self._render_keys[output_filename])
+
+    def _artifactExists(self, artifact):
+        return os.path.exists(artifact) or arcpy.Exists(artifact)
+
+    def _fingerprint(self, path):
+        return self._stageLogs()[0].fingerprint(path)
+
+    def _mxdKey(self):
+        """ Data is referenced by path, so the MXD only depends on the
+        template, styles and definitions, not on the data itself.
+        """
+        if not self._stageLogs():
+            return None
+        return manifest.definition_hash(self.name, self.author,
+                                        self._fingerprint(self.template_mxd),
+                                        self._fingerprint(self.style_path),
+                                        self.legend_x, self.legend_y,
+                                        self.mxd_definition)
+
+    def _tableKey(self, table):
+        if not self._stageLogs():
+            return None
+        return manifest.definition_hash(self._fingerprint(table.path), vars(table))
+
+    def _geocodeKey(self, table):
+        if not self._stageLogs():
+            return None
+        return manifest.definition_hash(self._dataset_keys.get(table.name), vars(table),
+                                        self.address_locator,
+                                        geocache.locator_version(self.address_locator),
+                                        geocode.ADDRESS_FIELDS)
+
+    def _joinKey(self, definition, layer_path, join_features):
+        if not self._stageLogs():
+            return None
+        return manifest.definition_hash(definition,
+                                        self._inputKey(layer_path),
+                                        self._inputKey(join_features))
+
+    def _generalizeKey(self, path, tolerance):
+        if not self._stageLogs():
+            return None
+        return manifest.definition_hash(self._inputKey(path), tolerance)
+
+    def _outputKey(self, output):
+        if self.checkpoint is None:
+            return None
+        return manifest.definition_hash(output, self.header_prefix, self._mxdKey())
+
+    def _inputKey(self, path):
+        """ Uses the key of the stage that built `path` when it is a project
+        GDB dataset, otherwise fingerprints the path.
+        """
+        name = os.path.basename(path)
+        if os.path.dirname(path) in (self.gdb_path, scratch.WORKSPACE) and name in self._dataset_keys:
+            return self._dataset_keys[name]
+        return self._fingerprint(path)
         
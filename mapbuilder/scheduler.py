@@ -0,0 +1,186 @@
+""" The scheduler module runs a graph of dependent tasks.
+
+GDB tasks (table loads, geocodes, spatial joins) do not touch the MXD and can
+run in worker processes.  MXD tasks always run one at a time in the owner
+process, which holds the only open MapDocument.  The critical path (the
+longest chain of dependent tasks) is logged after each run.
+"""
+import time
+import collections
+import multiprocessing
+import trace
+
+GDB = 'gdb'
+MXD = 'mxd'
+
+
+class Task(object):
+    """ A unit of work in a task graph. """
+
+    def __init__(self, name, run, deps=None, kind=MXD, job=None, done=None):
+        """ `run` is called without arguments in the owner process and returns
+        the task's result.  `deps` lists the names of tasks that must finish
+        first.
+
+        GDB tasks run in a worker process when the scheduler has workers and
+        `job` is set:  `job` returns the (picklable) argument passed to the
+        scheduler's worker function, and `done` is called in the owner with
+        the worker's result.
+        """
+        self.name = name
+        self.run = run
+        if deps is None:
+            deps = list()
+        self.deps = list(deps)
+        self.kind = kind
+        self.job = job
+        self.done = done
+        self.start = None
+        self.end = None
+
+    @property
+    def seconds(self):
+        return self.end - self.start
+
+
+class Scheduler(object):
+    """ Runs tasks once their dependencies finish. """
+
+    def __init__(self, workers=1, worker=None):
+        """ `worker` is the module level function run by worker processes
+        for GDB tasks, only used when `workers` is above 1.
+        """
+        self.workers = workers
+        self.worker = worker
+        self.tasks = collections.OrderedDict()
+        self.results = dict()
+        self.start = None
+        self.end = None
+
+    def add(self, task):
+        if task.name in self.tasks:
+            raise ValueError('Task "%s" is already in the graph.' % (task.name))
+        self.tasks[task.name] = task
+        return task
+
+    def order(self):
+        """ Returns task names in dependency order, keeping the order tasks
+        were added where dependencies allow.
+        """
+        for task in self.tasks.values():
+            for dep in task.deps:
+                if dep not in self.tasks:
+                    raise KeyError('Task "%s" depends on unknown task "%s".' % (task.name, dep))
+        order = list()
+        done = set()
+        remaining = list(self.tasks)
+        while remaining:
+            for name in remaining:
+                if all([dep in done for dep in self.tasks[name].deps]):
+                    break
+            else:
+                raise ValueError('Task graph has a cycle between: %s' % (', '.join(remaining)))
+            remaining.remove(name)
+            order.append(name)
+            done.add(name)
+        return order
+
+    def run(self):
+        """ Runs every task and returns a dictionary of task name -> result. """
+        order = self.order()
+        self.results = dict()
+        self.start = time.time()
+        pooled = [task for task in self.tasks.values() if task.kind == GDB and task.job is not None]
+        if self.workers > 1 and self.worker is not None and pooled:
+            print('\nRunning %s tasks, GDB tasks use %s worker processes.' % (len(order), self.workers))
+            self._runPool(order)
+        else:
+            print('\nRunning %s tasks.' % (len(order)))
+            for name in order:
+                self._runInline(self.tasks[name])
+        self.end = time.time()
+        self.printCriticalPath()
+        return self.results
+
+    def _runInline(self, task):
+        task.start = time.time()
+        self.results[task.name] = task.run()
+        task.end = time.time()
+        trace.record(task.name, 'stage', task.start, task.end, kind=task.kind)
+
+    def _runPool(self, order):
+        """ Dispatches ready GDB tasks to the pool, running ready MXD tasks in
+        this process while the workers are busy.
+        """
+        pool = multiprocessing.Pool(processes=self.workers)
+        pending = list(order)
+        running = dict()
+        try:
+            while pending or running:
+                for name, result in list(running.items()):
+                    if result.ready():
+                        task = self.tasks[name]
+                        value = result.get()
+                        task.end = time.time()
+                        trace.record(name, 'stage', task.start, task.end, kind=task.kind, worker=True)
+                        del running[name]
+                        if task.done is not None:
+                            value = task.done(value)
+                        self.results[name] = value
+
+                ready = [name for name in pending
+                         if all([dep in self.results for dep in self.tasks[name].deps])]
+                for name in ready:
+                    task = self.tasks[name]
+                    if task.kind == GDB and task.job is not None:
+                        pending.remove(name)
+                        task.start = time.time()
+                        running[name] = pool.apply_async(self.worker, (task.job(),))
+
+                mxd_ready = [name for name in ready if name in pending]
+                if mxd_ready:
+                    pending.remove(mxd_ready[0])
+                    self._runInline(self.tasks[mxd_ready[0]])
+                elif running:
+                    time.sleep(0.05)
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+    def criticalPath(self):
+        """ Returns the task names on the longest chain of dependent tasks,
+        by task duration, and the chain's total seconds.
+        """
+        finish = dict()
+        previous = dict()
+        for name in self.order():
+            task = self.tasks[name]
+            before = None
+            for dep in task.deps:
+                if before is None or finish[dep] > finish[before]:
+                    before = dep
+            previous[name] = before
+            finish[name] = task.seconds + (finish[before] if before is not None else 0.0)
+        if not finish:
+            return list(), 0.0
+        name = max(finish, key=lambda n: finish[n])
+        total = finish[name]
+        path = list()
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+        path.reverse()
+        return path, total
+
+    def printCriticalPath(self):
+        path, total = self.criticalPath()
+        busy = sum([task.seconds for task in self.tasks.values()])
+        print('\nTask graph:  %.2fs wall, %.2fs of task time.' % (self.end - self.start, busy))
+        print('Critical path (%.2fs):' % (total))
+        for name in path:
+            task = self.tasks[name]
+            print('  %8.2fs  %-3s  %s' % (task.seconds, task.kind, name))
@@ -0,0 +1,50 @@
+""" The scratch module keeps intermediate datasets in ArcGIS's in_memory
+workspace instead of the project GDB, so datasets that only feed a later
+stage are never written to disk and read back.
+
+in_memory belongs to one process:  a scratch dataset can only be read by the
+process that wrote it, and is gone when that process exits.
+"""
+import os
+from lazy import arcpy
+
+WORKSPACE = 'in_memory'
+
+# Approximate bytes per value on disk by field type, text uses the field length.
+FIELD_BYTES = {'SmallInteger': 2, 'Integer': 4, 'Single': 4, 'Double': 8, 'Date': 8,
+               'OID': 4, 'GUID': 16, 'GlobalID': 16}
+# Approximate bytes per geometry by shape type, lines and polygons assume 64 vertices.
+SHAPE_BYTES = {'Point': 16}
+VERTEX_BYTES = 16
+DEFAULT_VERTICES = 64
+
+
+def path(name):
+    return os.path.join(WORKSPACE, name)
+
+
+def is_scratch(dataset_path):
+    return os.path.dirname(dataset_path) == WORKSPACE
+
+
+def delete(dataset_path):
+    if arcpy.Exists(dataset_path):
+        arcpy.Delete_management(dataset_path)
+
+
+def estimate_bytes(dataset_path):
+    """ Returns the approximate size of a dataset on disk:  the row count
+    times the field widths, plus a geometry estimate for feature classes.
+    Rows are counted without reading them.
+    """
+    width = 0
+    for field in arcpy.ListFields(dataset_path):
+        if field.type == 'Geometry':
+            shape_type = arcpy.Describe(dataset_path).shapeType
+            width += SHAPE_BYTES.get(shape_type, DEFAULT_VERTICES * VERTEX_BYTES)
+        elif field.type == 'String':
+            width += field.length
+        else:
+            width += FIELD_BYTES.get(field.type, 8)
+    rows = int(arcpy.GetCount_management(dataset_path).getOutput(0))
+    return rows * width
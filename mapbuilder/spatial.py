@@ -0,0 +1,230 @@
+""" The spatial module contains NumPy helpers for point in polygon joins: a
+uniform grid index over polygon bounding boxes and a vectorized even-odd
+(ray casting) point in polygon test.
+
+Nothing here depends on ArcPy, geometries are passed in as arrays.
+"""
+import numpy
+
+
+def rings_to_edges(rings):
+    """ Returns a (k, 4) array of x1, y1, x2, y2 edges for a polygon.
+
+    `rings` is a list of (n, 2) vertex arrays covering every part and hole of
+    the polygon.  Rings are closed if their last vertex does not repeat the
+    first.  Testing against all edges at once with the even-odd rule handles
+    holes and multipart polygons.
+    """
+    edges = list()
+    for ring in rings:
+        ring = numpy.asarray(ring, dtype='float64')
+        if len(ring) < 3:
+            continue
+        if not numpy.array_equal(ring[0], ring[-1]):
+            ring = numpy.vstack([ring, ring[:1]])
+        edges.append(numpy.hstack([ring[:-1], ring[1:]]))
+    if not edges:
+        return numpy.zeros((0, 4))
+    return numpy.vstack(edges)
+
+
+def points_in_polygon(xs, ys, edges, chunk_size=512):
+    """ Returns a boolean array, True for points inside the polygon.
+
+    Edges are processed in chunks so memory stays at len(xs) * chunk_size.
+    Points exactly on an edge may fall on either side.
+    """
+    inside = numpy.zeros(len(xs), dtype=bool)
+    px = numpy.asarray(xs, dtype='float64')[:, numpy.newaxis]
+    py = numpy.asarray(ys, dtype='float64')[:, numpy.newaxis]
+    for start in range(0, len(edges), chunk_size):
+        x1, y1, x2, y2 = edges[start:start + chunk_size].T
+        straddles = (y1 > py) != (y2 > py)
+        dy = numpy.where(y2 == y1, 1.0, y2 - y1)
+        x_cross = x1 + (py - y1) * (x2 - x1) / dy
+        crossings = (straddles & (px < x_cross)).sum(axis=1)
+        inside ^= (crossings % 2).astype(bool)
+    return inside
+
+
+class GridIndex(object):
+    """ Uniform grid over polygon bounding boxes.
+
+    Each cell lists the polygons whose bounding box overlaps it, stored as
+    flat (CSR style) arrays so candidate lookups for many points are
+    vectorized.
+    """
+
+    def __init__(self, bboxes, cell_size=None):
+        """ `bboxes` is an (n, 4) array of xmin, ymin, xmax, ymax.  The default
+        cell size gives at most about one cell per polygon.
+        """
+        self.bboxes = numpy.asarray(bboxes, dtype='float64').reshape(-1, 4)
+        if len(self.bboxes) == 0:
+            self.xmin = self.ymin = 0.0
+            self.cell_size = 1.0
+            self.nx = self.ny = 1
+            self.starts = numpy.zeros(2, dtype='int64')
+            self.polygons = numpy.zeros(0, dtype='int64')
+            return
+
+        self.xmin = self.bboxes[:, 0].min()
+        self.ymin = self.bboxes[:, 1].min()
+        width = max(self.bboxes[:, 2].max() - self.xmin, 1e-12)
+        height = max(self.bboxes[:, 3].max() - self.ymin, 1e-12)
+        if cell_size is None:
+            # Boxes along one line have no area, the length bound keeps the
+            # grid to about one cell per polygon.
+            cell_size = max(numpy.sqrt(width * height / len(self.bboxes)),
+                            max(width, height) / len(self.bboxes), 1e-12)
+        self.cell_size = float(cell_size)
+        self.nx = int(width // self.cell_size) + 1
+        self.ny = int(height // self.cell_size) + 1
+
+        ix0, iy0 = self._cell(self.bboxes[:, 0], self.bboxes[:, 1])
+        ix1, iy1 = self._cell(self.bboxes[:, 2], self.bboxes[:, 3])
+        cells = list()
+        polygons = list()
+        for i in range(len(self.bboxes)):
+            gx, gy = numpy.meshgrid(numpy.arange(ix0[i], ix1[i] + 1),
+                                    numpy.arange(iy0[i], iy1[i] + 1))
+            cell_ids = (gy * self.nx + gx).ravel()
+            cells.append(cell_ids)
+            polygons.append(numpy.repeat(i, len(cell_ids)))
+        cells = numpy.concatenate(cells)
+        polygons = numpy.concatenate(polygons)
+        order = numpy.argsort(cells, kind='mergesort')
+        self.polygons = polygons[order]
+        counts = numpy.bincount(cells, minlength=self.nx * self.ny)
+        self.starts = numpy.concatenate([[0], numpy.cumsum(counts)])
+
+    def _cell(self, xs, ys):
+        ix = numpy.floor((numpy.asarray(xs) - self.xmin) / self.cell_size).astype('int64')
+        iy = numpy.floor((numpy.asarray(ys) - self.ymin) / self.cell_size).astype('int64')
+        return numpy.clip(ix, 0, self.nx - 1), numpy.clip(iy, 0, self.ny - 1)
+
+    def candidates(self, xs, ys):
+        """ Returns (point index, polygon index) arrays for every polygon whose
+        bounding box contains the point.
+        """
+        xs = numpy.asarray(xs, dtype='float64')
+        ys = numpy.asarray(ys, dtype='float64')
+        ix, iy = self._cell(xs, ys)
+        cell_ids = iy * self.nx + ix
+        starts = self.starts[cell_ids]
+        counts = self.starts[cell_ids + 1] - starts
+        point_idx = numpy.repeat(numpy.arange(len(xs)), counts)
+        offsets = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        polygon_idx = self.polygons[numpy.repeat(starts, counts) + offsets]
+
+        bboxes = self.bboxes[polygon_idx]
+        px = xs[point_idx]
+        py = ys[point_idx]
+        in_bbox = ((px >= bboxes[:, 0]) & (px <= bboxes[:, 2])
+                   & (py >= bboxes[:, 1]) & (py <= bboxes[:, 3]))
+        return point_idx[in_bbox], polygon_idx[in_bbox]
+
+    def query(self, xmin, ymin, xmax, ymax):
+        """ Returns the sorted indexes of the bounding boxes that overlap the
+        box xmin, ymin, xmax, ymax.
+        """
+        if len(self.bboxes) == 0:
+            return numpy.zeros(0, dtype='int64')
+        (ix0, ix1), (iy0, iy1) = self._cell([xmin, xmax], [ymin, ymax])
+        # Cells in a grid row are contiguous, so one slice covers each row.
+        rows = [self.polygons[self.starts[iy * self.nx + ix0]:self.starts[iy * self.nx + ix1 + 1]]
+                for iy in range(iy0, iy1 + 1)]
+        polygons = numpy.unique(numpy.concatenate(rows))
+        bboxes = self.bboxes[polygons]
+        overlaps = ((bboxes[:, 0] <= xmax) & (bboxes[:, 2] >= xmin)
+                    & (bboxes[:, 1] <= ymax) & (bboxes[:, 3] >= ymin))
+        return polygons[overlaps]
+
+    def intersects(self, xmin, ymin, xmax, ymax):
+        """ Returns True when any bounding box in the index overlaps the box
+        xmin, ymin, xmax, ymax.
+        """
+        return len(self.query(xmin, ymin, xmax, ymax)) > 0
+
+
+def join_points(xs, ys, polygon_edges, bboxes):
+    """ Returns (point index, polygon index) arrays for every point inside a
+    polygon.  A point inside overlapping polygons is matched to each of them.
+
+    `polygon_edges` is a list of edge arrays from rings_to_edges() and
+    `bboxes` the matching (n, 4) array of polygon bounding boxes.
+    """
+    xs = numpy.asarray(xs, dtype='float64')
+    ys = numpy.asarray(ys, dtype='float64')
+    index = GridIndex(bboxes)
+    point_idx, polygon_idx = index.candidates(xs, ys)
+    if len(point_idx) == 0:
+        return point_idx, polygon_idx
+
+    order = numpy.argsort(polygon_idx, kind='mergesort')
+    point_idx = point_idx[order]
+    polygon_idx = polygon_idx[order]
+    bounds = numpy.flatnonzero(numpy.diff(polygon_idx)) + 1
+    matched_points = list()
+    matched_polygons = list()
+    for group in numpy.split(numpy.arange(len(polygon_idx)), bounds):
+        polygon = polygon_idx[group[0]]
+        points = point_idx[group]
+        inside = points_in_polygon(xs[points], ys[points], polygon_edges[polygon])
+        matched_points.append(points[inside])
+        matched_polygons.append(numpy.repeat(polygon, inside.sum()))
+    return numpy.concatenate(matched_points), numpy.concatenate(matched_polygons)
+
+
+AGGREGATE_STATS = ('count', 'sum', 'mean')
+
+
+def aggregate_points(point_idx, polygon_idx, polygon_count, stats, values=None, groups=None):
+    """ Computes per polygon statistics for joined points in one pass.
+
+    `point_idx` and `polygon_idx` are the matches from join_points().
+    `stats` is a list of (statistic, field) tuples where statistic is one of
+    AGGREGATE_STATS and field is None for 'count'.  `values` maps field
+    names to per point float arrays (NaN for nulls) and `groups` is an
+    optional per point array of group values.
+
+    Returns a list of (column name, array) tuples with one value per polygon.
+    Column names are COUNT, SUM_<field> and MEAN_<field>, suffixed with
+    _<group value> when grouping.  Means are NaN where no values were joined.
+    """
+    if values is None:
+        values = dict()
+    if groups is None:
+        group_labels = [None]
+        slots = polygon_idx
+    else:
+        group_labels, group_ids = numpy.unique(numpy.asarray(groups)[point_idx],
+                                               return_inverse=True)
+        slots = polygon_idx * len(group_labels) + group_ids
+    size = polygon_count * len(group_labels)
+
+    results = list()
+    for stat, field in stats:
+        if stat not in AGGREGATE_STATS:
+            raise ValueError('Unknown aggregate statistic "%s".' % (stat))
+        if stat == 'count':
+            name = 'COUNT'
+            column = numpy.bincount(slots, minlength=size).astype('float64')
+        else:
+            name = '%s_%s' % (stat.upper(), field)
+            joined = numpy.asarray(values[field], dtype='float64')[point_idx]
+            valid = ~numpy.isnan(joined)
+            column = numpy.bincount(slots, weights=numpy.where(valid, joined, 0.0),
+                                    minlength=size)
+            if stat == 'mean':
+                counts = numpy.bincount(slots, weights=valid.astype('float64'),
+                                        minlength=size)
+                with numpy.errstate(invalid='ignore', divide='ignore'):
+                    column = numpy.where(counts > 0, column / counts, numpy.nan)
+        column = column.reshape(polygon_count, len(group_labels))
+        for i, label in enumerate(group_labels):
+            if label is None:
+                results.append((name, column[:, i]))
+            else:
+                results.append(('%s_%s' % (name, label), column[:, i]))
+    return results
@@ -0,0 +1,182 @@
+""" The spatialjoin module runs point in polygon spatial joins with the NumPy
+helpers in the spatial module.  Points and polygons are read in bulk and only
+polygons containing at least one point are written to the output.
+"""
+import os
+import numpy
+from lazy import arcpy
+import spatial
+import geocode
+
+
+def read_points(path, spatial_reference, value_fields=None, group_field=None):
+    """ Returns x and y arrays for the points with a location, projected to
+    `spatial_reference`, a dictionary of value field -> float array (NaN for
+    nulls) and an array of `group_field` values (None when not grouping).
+    """
+    if not value_fields and group_field is None:
+        points = arcpy.da.FeatureClassToNumPyArray(path, ['SHAPE@X', 'SHAPE@Y'],
+                                                   spatial_reference=spatial_reference,
+                                                   skip_nulls=True)
+        return points['SHAPE@X'], points['SHAPE@Y'], dict(), None
+
+    value_fields = list(value_fields or list())
+    fields = ['SHAPE@XY'] + value_fields
+    if group_field is not None:
+        fields.append(group_field)
+    xs = list()
+    ys = list()
+    columns = [list() for f in fields[1:]]
+    with arcpy.da.SearchCursor(path, fields, spatial_reference=spatial_reference) as cursor:
+        for row in cursor:
+            x, y = row[0]
+            if x is None or y is None:
+                continue
+            xs.append(x)
+            ys.append(y)
+            for column, value in zip(columns, row[1:]):
+                column.append(value)
+
+    values = dict()
+    for field, column in zip(value_fields, columns):
+        values[field] = numpy.array([numpy.nan if v is None else v for v in column],
+                                    dtype='float64')
+    groups = None
+    if group_field is not None:
+        groups = numpy.array(['NULL' if v is None else '%s' % (v,) for v in columns[-1]])
+    return numpy.array(xs, dtype='float64'), numpy.array(ys, dtype='float64'), values, groups
+
+
+def read_polygons(path):
+    """ Returns a list of object ids, a list of edge arrays and an (n, 4)
+    array of bounding boxes for the polygons in `path`.
+    """
+    oids = list()
+    edges = list()
+    bboxes = list()
+    with arcpy.da.SearchCursor(path, ['OID@', 'SHAPE@']) as cursor:
+        for oid, geometry in cursor:
+            if geometry is None:
+                continue
+            rings = list()
+            for part in geometry:
+                ring = list()
+                for point in part:
+                    # Interior rings are separated by None.
+                    if point is None:
+                        rings.append(ring)
+                        ring = list()
+                    else:
+                        ring.append((point.X, point.Y))
+                rings.append(ring)
+            extent = geometry.extent
+            oids.append(oid)
+            edges.append(spatial.rings_to_edges(rings))
+            bboxes.append((extent.XMin, extent.YMin, extent.XMax, extent.YMax))
+    return oids, edges, numpy.array(bboxes, dtype='float64').reshape(-1, 4)
+
+
+def write_matched(target_features, out_feature_class, columns, keep_fields=None):
+    """ Writes the target polygons listed in `columns` to a new feature class.
+
+    `columns` is a list of (field name, field type, {object id: value})
+    tuples.  Polygons missing from the first column's values are not
+    written.  The target's attribute fields (or only `keep_fields`) and a
+    TARGET_FID field are kept.
+    """
+    if arcpy.Exists(out_feature_class):
+        arcpy.Delete_management(out_feature_class)
+    out_path, out_name = os.path.split(out_feature_class)
+    spatial_reference = arcpy.Describe(target_features).spatialReference
+    arcpy.CreateFeatureclass_management(out_path, out_name, 'POLYGON',
+                                        spatial_reference=spatial_reference)
+
+    copy_fields = list()
+    for field in arcpy.ListFields(target_features):
+        if field.required or field.type not in geocode.FIELD_TYPES:
+            continue
+        if keep_fields is not None and field.name not in keep_fields:
+            continue
+        arcpy.AddField_management(out_feature_class, field.name,
+                                  geocode.FIELD_TYPES[field.type], field.precision,
+                                  field.scale, field.length, field.aliasName)
+        copy_fields.append(field.name)
+    arcpy.AddField_management(out_feature_class, 'TARGET_FID', 'LONG')
+    for field_name, field_type, values in columns:
+        arcpy.AddField_management(out_feature_class, field_name, field_type)
+    matched = columns[0][2]
+
+    insert_fields = ['SHAPE@', 'TARGET_FID'] + copy_fields + [c[0] for c in columns]
+    with arcpy.da.SearchCursor(target_features, ['OID@', 'SHAPE@'] + copy_fields) as search:
+        with arcpy.da.InsertCursor(out_feature_class, insert_fields) as insert:
+            for row in search:
+                oid = row[0]
+                if oid not in matched:
+                    continue
+                values = tuple([c[2].get(oid) for c in columns])
+                insert.insertRow((row[1], oid) + tuple(row[2:]) + values)
+
+
+def join_points_to_polygons(target_features, join_features, out_feature_class):
+    """ Counts the points of `join_features` inside each polygon of
+    `target_features` and writes the matched polygons, with a Join_Count
+    field, to `out_feature_class`.
+
+    Returns (matched polygon count, total polygon count).
+    """
+    oids, edges, bboxes = read_polygons(target_features)
+    spatial_reference = arcpy.Describe(target_features).spatialReference
+    xs, ys, values, groups = read_points(join_features, spatial_reference)
+    point_idx, polygon_idx = spatial.join_points(xs, ys, edges, bboxes)
+    counts = numpy.bincount(polygon_idx, minlength=len(oids))
+    join_count = dict([(oids[i], int(counts[i])) for i in numpy.flatnonzero(counts)])
+    write_matched(target_features, out_feature_class,
+                  [('Join_Count', 'LONG', join_count)])
+    return len(join_count), len(oids)
+
+
+def aggregate_points_to_polygons(target_features, join_features, out_feature_class,
+                                 aggregate):
+    """ Joins points to polygons and computes every statistic in `aggregate`
+    in one pass over the points, writing a polygon feature class with
+    Join_Count and one field per statistic (and group value).
+
+    `aggregate` is a dictionary with the keys:
+        * stats - List of (statistic, field) tuples, statistic is 'count',
+          'sum' or 'mean' and field is None for 'count'
+        * group_by - Optional field, statistics are computed per value
+        * keep_fields - Optional list of target fields to keep, default all
+
+    Returns (matched polygon count, total polygon count, field names).
+    """
+    try:
+        stats = aggregate['stats']
+    except KeyError:
+        raise KeyError('The "stats" key is required for a spatial join aggregate.')
+    group_field = aggregate.get('group_by')
+    value_fields = sorted(set([field for stat, field in stats if field is not None]))
+
+    oids, edges, bboxes = read_polygons(target_features)
+    spatial_reference = arcpy.Describe(target_features).spatialReference
+    xs, ys, values, groups = read_points(join_features, spatial_reference,
+                                         value_fields, group_field)
+    point_idx, polygon_idx = spatial.join_points(xs, ys, edges, bboxes)
+    counts = numpy.bincount(polygon_idx, minlength=len(oids))
+    matched = numpy.flatnonzero(counts)
+
+    workspace = os.path.dirname(out_feature_class)
+    columns = [('Join_Count', 'LONG', dict([(oids[i], int(counts[i])) for i in matched]))]
+    for name, column in spatial.aggregate_points(point_idx, polygon_idx, len(oids),
+                                                 stats, values, groups):
+        field_name = arcpy.ValidateFieldName(name, workspace)
+        if name.startswith('COUNT'):
+            field_type = 'LONG'
+            column_values = dict([(oids[i], int(column[i])) for i in matched])
+        else:
+            field_type = 'DOUBLE'
+            column_values = dict([(oids[i], None if numpy.isnan(column[i]) else float(column[i]))
+                                  for i in matched])
+        columns.append((field_name, field_type, column_values))
+
+    write_matched(target_features, out_feature_class, columns, aggregate.get('keep_fields'))
+    return len(matched), len(oids), [c[0] for c in columns]
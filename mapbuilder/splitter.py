@@ -0,0 +1,142 @@
+""" The splitter module splits a delimited text file into one file per value
+of a key column (e.g. campus or term), replacing the manual Data_Splitter.xlsm
+step.
+
+The input is streamed once and rows are written as they are read, so memory
+use does not depend on file size.  At most `max_open` output files are open
+at a time, the least recently used file is closed and reopened for append
+when its key comes up again.
+"""
+import os
+import re
+import sys
+import csv
+import json
+import codecs
+import collections
+import loader
+
+
+def safe_name(value):
+    """ Returns `value` reduced to letters, digits and underscores for use in
+    file and table names.  Empty values become NULL.
+    """
+    name = re.sub(r'[^0-9A-Za-z_]+', '_', value.strip()).strip('_')
+    return name or 'NULL'
+
+
+def _open_output(path, append):
+    if sys.version_info[0] < 3:
+        return open(path, 'ab' if append else 'wb')
+    return open(path, 'a' if append else 'w', newline='', encoding='utf-8')
+
+
+def _index_path(out_folder, name):
+    return os.path.join(out_folder, name + '.split.json')
+
+
+def _source_state(path, key_column, delimiter):
+    stat = os.stat(path)
+    return {'source': path, 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'key_column': key_column, 'delimiter': delimiter}
+
+
+def _load_index(out_folder, name, extension, state):
+    """ Returns the splits recorded for `state`, or None when the source or
+    any split file changed since.
+    """
+    path = _index_path(out_folder, name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        index = json.load(f)
+    if index.get('state') != state:
+        return None
+    splits = [tuple(split) for split in index['splits']]
+    for key, table_name, rows in splits:
+        if not os.path.exists(os.path.join(out_folder, table_name + extension)):
+            return None
+    return splits
+
+
+def _read_header(reader, path, key_column):
+    """ Returns the header row, without a UTF-8 BOM, and the index of
+    `key_column`.
+    """
+    header = next(reader)
+    if header and isinstance(header[0], bytes) and header[0].startswith(codecs.BOM_UTF8):
+        header[0] = header[0][len(codecs.BOM_UTF8):]
+    columns = [loader._decode(value).strip().lstrip(u'\ufeff') for value in header]
+    if key_column not in columns:
+        raise KeyError('Split column "%s" not found in %s.  Columns:  %s'
+                       % (key_column, path, ', '.join(columns)))
+    return header, columns.index(key_column)
+
+
+def check_header(path, key_column, delimiter='\t'):
+    """ Raises KeyError when `key_column` is not in the file's header row.
+    Only the header is read.
+    """
+    with loader.open_delimited(path) as f:
+        _read_header(csv.reader(f, delimiter=delimiter), path, key_column)
+
+
+def split_file(path, out_folder, name, key_column, extension='.txt', delimiter='\t',
+               max_open=64):
+    """ Splits the delimited file at `path` by the values of `key_column`.
+
+    Each key is written, with the header row, to `<name>_<key><extension>` in
+    `out_folder`.  Splitting is skipped when the source file has not changed
+    since the last split.
+
+    Returns a list of (key, table name, row count) tuples sorted by key.
+    """
+    state = _source_state(path, key_column, delimiter)
+    splits = _load_index(out_folder, name, extension, state)
+    if splits is not None:
+        print('\n%s is unchanged, reusing %s splits.' % (path, len(splits)))
+        return splits
+
+    table_names = dict()
+    counts = dict()
+    handles = collections.OrderedDict()
+    opened = set()
+    with loader.open_delimited(path) as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header, key_index = _read_header(reader, path, key_column)
+
+        try:
+            for row in reader:
+                key = loader._decode(row[key_index]).strip() if key_index < len(row) else u''
+                if key not in table_names:
+                    table_name = '%s_%s' % (name, safe_name(key))
+                    used = set(table_names.values())
+                    suffix = 2
+                    while table_name in used:
+                        table_name = '%s_%s_%s' % (name, safe_name(key), suffix)
+                        suffix += 1
+                    table_names[key] = table_name
+                    counts[key] = 0
+
+                handle = handles.pop(key, None)
+                if handle is None:
+                    if len(handles) >= max_open:
+                        handles.popitem(last=False)[1][0].close()
+                    out_path = os.path.join(out_folder, table_names[key] + extension)
+                    out_file = _open_output(out_path, key in opened)
+                    writer = csv.writer(out_file, delimiter=delimiter)
+                    if key not in opened:
+                        writer.writerow(header)
+                        opened.add(key)
+                    handle = (out_file, writer)
+                handles[key] = handle
+                handle[1].writerow(row)
+                counts[key] += 1
+        finally:
+            for out_file, writer in handles.values():
+                out_file.close()
+
+    splits = [(key, table_names[key], counts[key]) for key in sorted(table_names)]
+    with open(_index_path(out_folder, name), 'w') as f:
+        json.dump({'state': state, 'splits': splits}, f, indent=2, sort_keys=True)
+    return splits
@@ -14,6 +14,14 @@ class Table(object):
             * geocode
             * geocode_layer_name
             * geocode_layer_style
+            * geocode_dedupe
+            * geocode_shard_size
+            * geocode_workers
+            * loader
+            * chunk_size
+            * schema
+            * delimiter
+            * sample_rows
             * layer_visible
         """
 
@@ -52,4 +60,69 @@ class Table(object):
         except KeyError:
             self.geocode_layer_style = None
 
-        self.visible = definition['visible']
+
+        # Geocode unique normalized addresses once, then join back to every row.
+        try:
+            self.geocode_dedupe = definition['geocode_dedupe']
+        except KeyError:
+            self.geocode_dedupe = False
+
+
+        # Rows per shard when geocoding large tables in parallel, None disables sharding.
+        try:
+            self.geocode_shard_size = definition['geocode_shard_size']
+        except KeyError:
+            self.geocode_shard_size = None
+
+
+        try:
+            self.geocode_workers = definition['geocode_workers']
+        except KeyError:
+            self.geocode_workers = 1
+
+
+        # 'stream' loads delimited text in chunks with the loader module
+        # instead of TableToTable, for inputs too large to load at once.
+        try:
+            self.loader = definition['loader']
+        except KeyError:
+            self.loader = None
+
+
+        try:
+            self.chunk_size = definition['chunk_size']
+        except KeyError:
+            self.chunk_size = 50000
+
+
+        # Column name -> TEXT, LONG, DOUBLE or DATE, other columns are inferred.
+        try:
+            self.schema = definition['schema']
+        except KeyError:
+            self.schema = None
+
+
+        try:
+            self.delimiter = definition['delimiter']
+        except KeyError:
+            self.delimiter = '\t'
+
+
+        # Rows read to infer column types before the schema is pinned.
+        try:
+            self.sample_rows = definition['sample_rows']
+        except KeyError:
+            self.sample_rows = 1000
+
+
+        # True loads the table into the in_memory scratch workspace, for tables
+        # only used to geocode or join.  None uses the project's default.
+        try:
+            self.scratch = definition['scratch']
+        except KeyError:
+            self.scratch = None
+
+        try:
+            self.visible = definition['visible']
+        except KeyError:
+            raise KeyError('The "visible" key is required for the Table object.')
@@ -0,0 +1,100 @@
+""" The tiles module builds output definitions (OUTPUT_LIST entries) for
+atlases:  a grid of tiles over a bounding box, or one output per feature of a
+polygon layer.  Tiles that contain no data are dropped before export.
+
+Tile definitions (Config.OUTPUT_TILES) are dictionaries.  A grid needs a name,
+the bounding box (xmin, ymin, xmax, ymax) and either `tile_size` (in map
+units) or `rows` and `columns`.  Tiles are named "<name> R<row> C<column>",
+row 1 is the top row.
+
+A feature definition needs a name and the `path` of a polygon feature class.
+`name_field` names each output after a field value (default is the ObjectID),
+`where` filters the features and `margin` pads each extent by a fraction of
+its size (default 0.05).
+
+Either kind can set `skip_empty` (default True) and `layers`, the names of
+the layers that count as data (default is every visible layer).
+"""
+import math
+
+
+def _bounds(definition):
+    try:
+        bounds = [float(definition[key]) for key in ('xmin', 'ymin', 'xmax', 'ymax')]
+    except KeyError as e:
+        raise KeyError('Tile definition "%s" is missing the %s key.' % (definition.get('name'), e))
+    if bounds[0] >= bounds[2] or bounds[1] >= bounds[3]:
+        raise ValueError('Tile definition "%s":  xmin/ymin must be less than xmax/ymax.'
+                         % (definition['name']))
+    return bounds
+
+
+def grid_outputs(definition):
+    """ Returns an output definition for every tile in a grid definition.
+
+    With `tile_size` every tile is square and the grid may extend past the
+    bounding box's bottom and right edges.  With `rows` and `columns` the box
+    is divided evenly.
+    """
+    try:
+        name = definition['name']
+    except KeyError:
+        raise KeyError('The "name" key is required for tile definitions.')
+    xmin, ymin, xmax, ymax = _bounds(definition)
+
+    if 'tile_size' in definition:
+        width = height = float(definition['tile_size'])
+        if width <= 0:
+            raise ValueError('Tile definition "%s":  tile_size must be positive.' % (name))
+        columns = int(math.ceil((xmax - xmin) / width))
+        rows = int(math.ceil((ymax - ymin) / height))
+    else:
+        try:
+            rows = int(definition['rows'])
+            columns = int(definition['columns'])
+        except KeyError:
+            raise KeyError('Tile definition "%s" requires tile_size, or rows and columns.' % (name))
+        if rows < 1 or columns < 1:
+            raise ValueError('Tile definition "%s":  rows and columns must be at least 1.' % (name))
+        width = (xmax - xmin) / columns
+        height = (ymax - ymin) / rows
+
+    outputs = list()
+    for row in range(rows):
+        top = ymax - row * height
+        for column in range(columns):
+            left = xmin + column * width
+            outputs.append({'name': '%s R%02d C%02d' % (name, row + 1, column + 1),
+                            'xmin': left, 'ymin': top - height,
+                            'xmax': left + width, 'ymax': top})
+    return outputs
+
+
+def feature_outputs(definition, features):
+    """ Returns an output definition for each (feature name, bounds) in
+    `features`, padded by the definition's margin.
+    """
+    try:
+        name = definition['name']
+    except KeyError:
+        raise KeyError('The "name" key is required for tile definitions.')
+    try:
+        margin = float(definition['margin'])
+    except KeyError:
+        margin = 0.05
+
+    outputs = list()
+    for feature_name, (xmin, ymin, xmax, ymax) in features:
+        pad = max(xmax - xmin, ymax - ymin) * margin
+        outputs.append({'name': '%s %s' % (name, feature_name),
+                        'xmin': xmin - pad, 'ymin': ymin - pad,
+                        'xmax': xmax + pad, 'ymax': ymax + pad})
+    return outputs
+
+
+def drop_empty(outputs, index):
+    """ Returns the outputs whose extent overlaps a feature bounding box in
+    `index` (a spatial.GridIndex).
+    """
+    return [output for output in outputs
+            if index.intersects(output['xmin'], output['ymin'], output['xmax'], output['ymax'])]
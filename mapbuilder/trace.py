@@ -0,0 +1,177 @@
+""" The trace module records where the time in a run goes:  Controller
+stages, Project methods, ArcPy calls and output exports, plus row counts of
+the datasets a run produces.
+
+A run's events are saved as JSON, or in Chrome trace format (open it at
+chrome://tracing), and summarized in a table at the end of the run.  Hooks
+receive every event as it is recorded, e.g. to forward metrics to another
+collector.
+
+Recording is off unless a Tracer is started, record() and span() do nothing
+otherwise.
+"""
+import os
+import json
+import time
+import types
+import threading
+import contextlib
+from lazy import arcpy
+
+_tracer = None
+
+
+def current():
+    """ Returns the running Tracer, or None. """
+    return _tracer
+
+
+def record(name, category, start, end, **args):
+    if _tracer is not None:
+        _tracer.record(name, category, start, end, **args)
+
+
+@contextlib.contextmanager
+def span(name, category, **args):
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(name, category, start, time.time(), **args)
+
+
+class _TracedModule(object):
+    """ Proxy for an ArcPy submodule (arcpy.mapping, arcpy.da) whose
+    functions are timed.
+    """
+
+    def __init__(self, module, name, tracer):
+        self._module = module
+        self._name = name
+        self._tracer = tracer
+
+    def __getattr__(self, attr):
+        return self._tracer._wrapArcpy(self._name + '.' + attr, getattr(self._module, attr))
+
+
+class Tracer(object):
+    """ Collects timed events for one run. """
+
+    def __init__(self, hooks=None):
+        """ Each hook is called with the event dictionary (name, category,
+        start, seconds, args) of every event.
+        """
+        if hooks is None:
+            hooks = list()
+        self.hooks = list(hooks)
+        self.events = list()
+        self.counters = dict() # Name -> dictionary of values, e.g. rows per dataset
+        self.started = None
+        self._lock = threading.Lock()
+        self._instrumented = list() # (class, method name, original function)
+
+    def start(self, classes=None):
+        """ Starts recording:  ArcPy calls and the public (CamelCase) methods of
+        each (class, category) in `classes` are timed until stop().
+        """
+        global _tracer
+        self.started = time.time()
+        _tracer = self
+        arcpy._hook = self._wrapArcpy
+        for cls, category in classes or list():
+            self._instrument(cls, category)
+
+    def stop(self):
+        global _tracer
+        for cls, name, function in self._instrumented:
+            setattr(cls, name, function)
+        self._instrumented = list()
+        arcpy._hook = None
+        if _tracer is self:
+            _tracer = None
+
+    def record(self, name, category, start, end, **args):
+        event = {'name': name, 'category': category, 'start': start,
+                 'seconds': end - start, 'args': args,
+                 'pid': os.getpid(), 'tid': threading.current_thread().ident}
+        with self._lock:
+            self.events.append(event)
+        for hook in self.hooks:
+            hook(event)
+
+    def count(self, counter, name, value):
+        self.counters.setdefault(counter, dict())[name] = value
+        for hook in self.hooks:
+            hook({'name': name, 'category': counter, 'value': value})
+
+    def _instrument(self, cls, category):
+        for name, function in list(vars(cls).items()):
+            if not isinstance(function, types.FunctionType) or not name[0].isupper():
+                continue
+            setattr(cls, name, self._timed(function, '%s.%s' % (cls.__name__, name), category))
+            self._instrumented.append((cls, name, function))
+
+    def _timed(self, function, name, category):
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(name, category, start, time.time())
+        return timed
+
+    def _wrapArcpy(self, name, value):
+        if isinstance(value, types.ModuleType):
+            return _TracedModule(value, name, self)
+        if callable(value):
+            return self._timed(value, name, 'arcpy')
+        return value
+
+    def summary(self):
+        """ Returns (category, name, calls, total seconds, max seconds) rows
+        sorted by total seconds.
+        """
+        totals = dict()
+        for event in self.events:
+            key = (event['category'], event['name'])
+            calls, total, longest = totals.get(key, (0, 0.0, 0.0))
+            totals[key] = (calls + 1, total + event['seconds'], max(longest, event['seconds']))
+        rows = [(key[0], key[1]) + value for key, value in totals.items()]
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows
+
+    def printSummary(self, limit=25):
+        rows = self.summary()
+        print('\nTrace summary (%.2fs run, %s events):' % (time.time() - self.started, len(self.events)))
+        print('  %-8s  %6s  %9s  %9s  %s' % ('Category', 'Calls', 'Total', 'Max', 'Name'))
+        for category, name, calls, total, longest in rows[:limit]:
+            print('  %-8s  %6s  %8.2fs  %8.2fs  %s' % (category, calls, total, longest, name))
+        if len(rows) > limit:
+            print('  ... %s more, see the trace file.' % (len(rows) - limit))
+        for counter, values in sorted(self.counters.items()):
+            print('\n  %s:' % (counter))
+            for name, value in sorted(values.items()):
+                print('    %10s  %s' % (value, name))
+
+    def save(self, path, trace_format='json'):
+        """ Writes the trace as MapBuilder JSON ('json') or Chrome trace
+        format ('chrome').
+        """
+        if trace_format == 'chrome':
+            data = {'displayTimeUnit': 'ms', 'traceEvents': list()}
+            for event in self.events:
+                data['traceEvents'].append({'name': event['name'], 'cat': event['category'],
+                                            'ph': 'X',
+                                            'ts': (event['start'] - self.started) * 1000000.0,
+                                            'dur': event['seconds'] * 1000000.0,
+                                            'pid': event['pid'], 'tid': event['tid'],
+                                            'args': event['args']})
+            data['otherData'] = self.counters
+        elif trace_format == 'json':
+            data = {'started': self.started, 'events': self.events,
+                    'counters': self.counters, 'summary': self.summary()}
+        else:
+            raise ValueError('Unknown trace format "%s", use "json" or "chrome".' % (trace_format))
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True, default=repr)
+        print('\nTrace saved to:  %s' % (path))
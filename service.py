@@ -0,0 +1,281 @@
+""" Runs MapBuilder as a long running service so ArcPy, the license and
+template MXDs are loaded once instead of once per map job.
+
+Jobs are JSON objects:
+
+    {"id": "campus-a", "config": {"PROJECT_NAME": "Campus_A", ...}}
+
+where "config" sets Config attributes ("id" is optional).  Jobs are read from
+a spool directory (one .json file per job) and/or a socket on localhost (one
+JSON object per line).  Send {"command": "metrics"} or
+{"command": "status", "id": ...} over the socket to check on the service.
+
+Usage:
+    python service.py --spool C:\\MapBuilder\\Spool --port 8765
+"""
+import os
+import json
+import time
+import argparse
+import threading
+import arcpy
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from controller import Controller
+
+METRICS_FILE = 'service_metrics.json' # Written to the spool directory after each job.
+
+
+class TemplateCache(object):
+    """ Template MXDs opened once and reused by every job.  A template is
+    opened again when its file changes.  Jobs never save the template, each
+    job writes its own copy with saveACopy.
+    """
+
+    def __init__(self):
+        self.templates = dict() # Template path -> (modified time, MapDocument)
+        self.hits = 0
+        self.loads = 0
+
+    def get(self, path):
+        mtime = os.path.getmtime(path)
+        cached = self.templates.get(path)
+        if cached is not None and cached[0] == mtime:
+            self.hits += 1
+            return cached[1]
+        print('\nOpening template MXD:  %s' % (path))
+        mxd = arcpy.mapping.MapDocument(path)
+        self.templates[path] = (mtime, mxd)
+        self.loads += 1
+        return mxd
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """ Reads one JSON object per line and writes one JSON response per line. """
+
+    def handle(self):
+        service = self.server.service
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                message = json.loads(line.decode('utf-8'))
+                command = message.get('command', 'submit')
+                if command == 'metrics':
+                    response = service.metrics()
+                elif command == 'status':
+                    response = service.status(message['id'])
+                elif command == 'submit':
+                    response = service.submit(message)
+                else:
+                    raise ValueError('Unknown command "%s".' % (command))
+            except Exception as e:
+                response = {'status': 'error', 'error': '%s' % (e)}
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class JobServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Service(object):
+    """ Runs queued map jobs one at a time in this process. """
+
+    def __init__(self, spool_path=None, port=None, max_queue=50, warm_gdbs=False,
+                 poll_seconds=1.0):
+        """ `max_queue` bounds the number of jobs waiting to run, socket
+        submissions are rejected and spool files wait on disk while it is
+        full.  With `warm_gdbs` every job runs incrementally, reusing its
+        project GDB (and MXD) when the definitions have not changed.
+        """
+        self.spool_path = spool_path
+        self.port = port
+        self.warm_gdbs = warm_gdbs
+        self.poll_seconds = poll_seconds
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self.templates = TemplateCache()
+        self.statuses = dict() # Job id -> status dictionary
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counts = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+        self.wait_seconds = list()
+        self.run_seconds = list()
+        self._next_id = 1
+        self._server = None
+
+    def serve(self):
+        """ Runs jobs until interrupted (Ctrl+C). """
+        if self.spool_path is not None:
+            for folder in ('running', 'done', 'failed'):
+                path = os.path.join(self.spool_path, folder)
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+            print('\nWatching spool directory:  %s' % (self.spool_path))
+        if self.port is not None:
+            self._server = JobServer(('127.0.0.1', self.port), JobHandler)
+            self._server.service = self
+            thread = threading.Thread(target=self._server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            print('\nListening for jobs on 127.0.0.1:%s' % (self.port))
+
+        try:
+            while True:
+                self._claimSpoolFiles()
+                try:
+                    job = self.jobs.get(timeout=self.poll_seconds)
+                except queue.Empty:
+                    continue
+                self._runJob(job)
+        except KeyboardInterrupt:
+            print('\nStopping service.')
+        finally:
+            if self._server is not None:
+                self._server.shutdown()
+
+    def submit(self, message, spool_file=None):
+        """ Queues a job, returns its status.  Raises ValueError for a job
+        without a config.
+        """
+        if not isinstance(message.get('config'), dict):
+            raise ValueError('Jobs require a "config" object of Config attributes.')
+        with self.lock:
+            job_id = '%s' % (message.get('id') or self._next_id)
+            self._next_id += 1
+            job = {'id': job_id, 'config': message['config'],
+                   'queued': time.time(), 'spool_file': spool_file}
+            try:
+                self.jobs.put_nowait(job)
+            except queue.Full:
+                self.counts['rejected'] += 1
+                return {'id': job_id, 'status': 'rejected', 'error': 'Job queue is full.'}
+            self.counts['submitted'] += 1
+            self.statuses[job_id] = {'id': job_id, 'status': 'queued'}
+            return self.statuses[job_id]
+
+    def status(self, job_id):
+        with self.lock:
+            try:
+                return self.statuses['%s' % (job_id)]
+            except KeyError:
+                raise KeyError('Unknown job id "%s".' % (job_id))
+
+    def metrics(self):
+        with self.lock:
+            metrics = dict(self.counts)
+            metrics['queue_depth'] = self.jobs.qsize()
+            metrics['uptime_seconds'] = time.time() - self.started
+            for name, values in (('wait', self.wait_seconds), ('run', self.run_seconds)):
+                metrics[name + '_seconds_mean'] = sum(values) / len(values) if values else 0.0
+                metrics[name + '_seconds_max'] = max(values) if values else 0.0
+            metrics['template_hits'] = self.templates.hits
+            metrics['template_loads'] = self.templates.loads
+            return metrics
+
+    def _claimSpoolFiles(self):
+        """ Queues spool files, oldest first, while the queue has room.  A
+        file is moved to running/ when it is claimed.
+        """
+        if self.spool_path is None:
+            return
+        names = [name for name in os.listdir(self.spool_path)
+                 if name.lower().endswith('.json') and name != METRICS_FILE]
+        names.sort(key=lambda name: os.path.getmtime(os.path.join(self.spool_path, name)))
+        for name in names:
+            if self.jobs.full():
+                return
+            path = os.path.join(self.spool_path, name)
+            running_path = os.path.join(self.spool_path, 'running', name)
+            try:
+                os.rename(path, running_path)
+            except OSError:
+                continue # Still being written, or claimed by another service.
+            try:
+                with open(running_path) as f:
+                    message = json.load(f)
+                message.setdefault('id', os.path.splitext(name)[0])
+                if self.submit(message, running_path)['status'] == 'rejected':
+                    os.rename(running_path, path)
+                    return
+            except ValueError as e:
+                print('\nInvalid job file %s:  %s' % (name, e))
+                self._finishSpoolFile(running_path, 'failed', {'status': 'failed', 'error': '%s' % (e)})
+
+    def _runJob(self, job):
+        start = time.time()
+        wait = start - job['queued']
+        with self.lock:
+            self.statuses[job['id']] = {'id': job['id'], 'status': 'running'}
+        print('\nStarting job %s (waited %.2fs, %s queued).' % (job['id'], wait, self.jobs.qsize()))
+        try:
+            c = Controller()
+            for name, value in job['config'].items():
+                if name != name.upper():
+                    raise ValueError('Config attribute names are upper case, got "%s".' % (name))
+                setattr(c.config, name, value)
+            if self.warm_gdbs:
+                c.config.INCREMENTAL = True
+            c.template_cache = self.templates
+            c.run()
+            result = {'status': 'completed'}
+        except Exception as e:
+            print('\nJob %s failed:  %s' % (job['id'], e))
+            result = {'status': 'failed', 'error': '%s' % (e)}
+        seconds = time.time() - start
+        result.update({'id': job['id'], 'wait_seconds': wait, 'run_seconds': seconds})
+
+        with self.lock:
+            self.counts[result['status']] += 1
+            self.wait_seconds.append(wait)
+            self.run_seconds.append(seconds)
+            self.statuses[job['id']] = result
+        if job['spool_file'] is not None:
+            self._finishSpoolFile(job['spool_file'], 'done' if result['status'] == 'completed' else 'failed',
+                                  result)
+        self._printMetrics()
+
+    def _finishSpoolFile(self, path, folder, result):
+        name = os.path.basename(path)
+        target = os.path.join(self.spool_path, folder, name)
+        if os.path.exists(target):
+            os.remove(target)
+        os.rename(path, target)
+        with open(os.path.splitext(target)[0] + '.result.json', 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+    def _printMetrics(self):
+        metrics = self.metrics()
+        print('\nService:  %(completed)s completed, %(failed)s failed, %(rejected)s rejected, '
+              '%(queue_depth)s queued.  Wait %(wait_seconds_mean).2fs mean / %(wait_seconds_max).2fs max, '
+              'run %(run_seconds_mean).2fs mean / %(run_seconds_max).2fs max.' % metrics)
+        if self.spool_path is not None:
+            with open(os.path.join(self.spool_path, METRICS_FILE), 'w') as f:
+                json.dump(metrics, f, indent=2, sort_keys=True)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Runs MapBuilder jobs from a spool directory or socket.')
+    parser.add_argument('--spool', help='Directory watched for job .json files.')
+    parser.add_argument('--port', type=int, help='Port on 127.0.0.1 accepting JSON jobs, one per line.')
+    parser.add_argument('--max-queue', type=int, default=50, help='Maximum number of waiting jobs.')
+    parser.add_argument('--warm-gdbs', action='store_true',
+                        help='Run jobs incrementally, reusing project GDBs between jobs.')
+    options = parser.parse_args(args)
+    if options.spool is None and options.port is None:
+        parser.error('Set --spool, --port or both.')
+    Service(options.spool, options.port, options.max_queue, options.warm_gdbs).serve()
+
+
+if __name__ == '__main__':
+    main()
@@ -34,8 +34,14 @@ c.config.OUTPUT_MODE = 'Custom'
 # OUTPUT_LIST requires a List of Dictionaries.
 c.config.OUTPUT_LIST = [frcc_service_area]
 
-# Runs MapBuilder
-c.run()
+# Number of processes used to export outputs.  Parallel export requires
+# the __main__ guard below.
+c.config.OUTPUT_WORKERS = 1
+
+# Runs MapBuilder.  Use c.run(dry_run=True) to only validate the config and
+# list the planned operations, which does not start ArcGIS.
+if __name__ == '__main__':
+    c.run()
 
 
 